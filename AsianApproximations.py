@@ -0,0 +1,212 @@
+import AsianOptions
+import CVMCOptions
+import numpy as np
+from collections import defaultdict
+
+# Trapezoid intervals standing in for the continuous average of the FDS contract in the moment
+# sums, which leaves a relative error of about 1e-6 in the first three moments
+CONTINUOUS_FIXINGS = 200
+# Strikes of the moment matching error estimate, in Levy standard deviations of the log average around the strike
+ESTIMATE_STRIKES = np.linspace(-1, 1, 5)
+FALLBACKS = ('FDS', 'CVMC')
+
+
+def fixing_weights(fixings=None):
+    '''
+        Fixing times as fractions of the maturity and their weights in the average: the
+        trapezoid rule on CONTINUOUS_FIXINGS intervals for the continuous average of the FDS
+        contract (fixings None), else the fixings + 1 equally weighted points 0, T/N, ..., T
+        of the CVMC contract with N = fixings
+    '''
+    if fixings is None:
+        times = np.linspace(0, 1, CONTINUOUS_FIXINGS + 1)
+        weights = np.full(CONTINUOUS_FIXINGS + 1, 1 / CONTINUOUS_FIXINGS)
+        weights[[0, -1]] /= 2
+        return times, weights
+    return np.linspace(0, 1, fixings + 1), np.full(fixings + 1, 1 / (fixings + 1))
+
+
+def average_moments(initial_price, interest_rate, volatility, time_to_maturity, fixings=None):
+    '''
+        First three raw moments of the arithmetic average A = sum_i w_i S(t_i) and the mean
+        and variance of the log of the geometric average, for 1-D arrays of contracts. With
+        the fixings sorted, E[S(t_i) S(t_j) S(t_k)] for i <= j <= k is
+            S0^3 exp(r (t_i + t_j + t_k) + sigma^2 (2 t_i + t_j))
+        so all sums over pairs and triples factor into cumulative sums along the fixings
+    '''
+    times, weights = fixing_weights(fixings)
+    t = times * time_to_maturity[:, None]
+    rate, variance = interest_rate[:, None], volatility[:, None]**2
+    a = weights * np.exp(rate * t)
+    b = weights * np.exp((rate + variance) * t)
+    c = weights * np.exp((rate + 2 * variance) * t)
+    # Sums over the fixings strictly after (a) and strictly before (c) each fixing
+    a_after = np.cumsum(a[:, ::-1], axis=1)[:, ::-1] - a
+    c_before = np.cumsum(c, axis=1) - c
+
+    first = np.sum(a, axis=1)
+    second = np.sum(a * b + 2 * b * a_after, axis=1)
+    # Triples with all fixings distinct (6 orderings), two equal (3 orderings) and all equal
+    third = np.sum(6 * c_before * b * a_after + 3 * c * b * a_after + 3 * c_before * b * a + c * b * a, axis=1)
+
+    weights_after = np.cumsum(weights[::-1])[::-1] - weights
+    log_mean = np.log(initial_price) + (interest_rate - volatility**2 / 2) * time_to_maturity * np.dot(weights, times)
+    log_variance = volatility**2 * time_to_maturity * np.dot(weights * times, weights + 2 * weights_after)
+    return (initial_price * first, initial_price**2 * second, initial_price**3 * third), (log_mean, log_variance)
+
+
+def shifted_lognormal_price(moments, strike_price, discount, is_call=True):
+    '''
+        Price on A ~ shift + lognormal matching the mean, variance and skewness of the average,
+        where the lognormal shape exp(s^2) = 1 + x^2 solves the skewness x^3 + 3x = skewness
+    '''
+    first, second, third = moments
+    variance = second - first**2
+    skewness = (third - 3 * first * second + 2 * first**3) / variance**1.5
+    root = np.sqrt(skewness**2 / 4 + 1)
+    x = np.cbrt(skewness / 2 + root) + np.cbrt(skewness / 2 - root)
+    log_variance = np.log1p(x**2)
+    # Lognormal part with variance e^{2 mu + s^2} (e^{s^2} - 1), the shift makes up the mean
+    log_mean = 0.5 * (np.log(variance / x**2) - log_variance)
+    shift = first - np.exp(log_mean + log_variance / 2)
+    # A strike below the shift is always exercised by the call and never by the put
+    shifted_strike = strike_price - shift
+    in_the_money = np.where(is_call, discount * (first - strike_price), 0.0)
+    price = CVMCOptions.lognormal_option_price(log_mean, log_variance, np.maximum(shifted_strike, 1e-300), discount,
+                                               is_call)
+    return np.where(shifted_strike > 0, price, in_the_money)
+
+
+def moment_matching_prices(initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call=True,
+                           fixings=None, chunk_size=4096):
+    '''
+        Moment matching prices of Asian options with an error estimate, broadcasting the
+        arguments against each other. The price is that of a shifted lognormal matching the
+        mean, variance and skewness of the average (see shifted_lognormal_price). The estimate
+        is its largest distance to the Levy (Turnbull-Wakeman without dividends) price, a
+        lognormal matching only the mean and variance, over the strikes ESTIMATE_STRIKES
+        around the strike: the two prices cross near some strikes, where the distance at the
+        strike alone understates the error of the skewness corrected price. It is widened to
+        the geometric average option (closed form) where the price breaks the bound it sets:
+        the arithmetic call is worth at least and the arithmetic put at most the geometric
+        one. fixings selects the contract (see fixing_weights); the contracts are priced
+        chunk_size at a time to bound the (contracts x fixings) moment arrays. Returns prices
+        and error estimates
+    '''
+    arguments = np.broadcast_arrays(*(np.asarray(argument, dtype=np.float64) for argument in
+                                      (initial_price, strike_price, interest_rate, volatility, time_to_maturity)),
+                                    np.asarray(is_call, dtype=np.bool_))
+    shape = arguments[0].shape
+    initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call = \
+        [argument.ravel() for argument in arguments]
+    price = np.empty(len(initial_price))
+    error = np.empty(len(initial_price))
+    for start in range(0, len(initial_price), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        moments, (log_mean, log_variance) = average_moments(initial_price[chunk], interest_rate[chunk],
+                                                            volatility[chunk], time_to_maturity[chunk], fixings)
+        first, second, _ = moments
+        discount = np.exp(-interest_rate[chunk] * time_to_maturity[chunk])
+        levy_variance = np.log(second / first**2)
+        distance = 0
+        for deviations in ESTIMATE_STRIKES:
+            strike = strike_price[chunk] * np.exp(deviations * np.sqrt(levy_variance))
+            levy = CVMCOptions.lognormal_option_price(np.log(first) - levy_variance / 2, levy_variance, strike,
+                                                      discount, is_call[chunk])
+            skew = shifted_lognormal_price(moments, strike, discount, is_call[chunk])
+            distance = np.maximum(distance, np.abs(skew - levy))
+        skew = shifted_lognormal_price(moments, strike_price[chunk], discount, is_call[chunk])
+        geometric = CVMCOptions.lognormal_option_price(log_mean, log_variance, strike_price[chunk], discount,
+                                                       is_call[chunk])
+        bound_violation = np.maximum(np.where(is_call[chunk], geometric - skew, skew - geometric), 0)
+        price[chunk] = skew
+        error[chunk] = np.maximum(distance, bound_violation)
+    return price.reshape(shape)[()], error.reshape(shape)[()]
+
+
+def fds_fallback(contracts, time_partition_size=250, spatial_partition_size=4000, interpolation='linear',
+                 richardson=True):
+    '''
+        FDS prices of (initial price, strike, rate, volatility, maturity, is_call) contracts,
+        batched by rate and maturity (see AsianOptions.solve_volatilities), extrapolated from
+        grids with half the partition sizes if richardson. The error of the grids is mostly
+        spatial, so the defaults keep the z nodes fine and the time steps few, which keeps the
+        fallback well below the moment matching error (about 2e-4 at most for sigma down to
+        0.1). Returns prices and error estimates, the size of the Richardson correction (nan
+        without richardson)
+    '''
+    batches = defaultdict(list)
+    for index, (_, _, interest_rate, _, time_to_maturity, _) in enumerate(contracts):
+        batches[(interest_rate, time_to_maturity)].append(index)
+    prices = np.empty(len(contracts))
+    errors = np.full(len(contracts), np.nan)
+    for (interest_rate, time_to_maturity), indices in batches.items():
+        volatilities = sorted({contracts[index][3] for index in indices})
+        grids = AsianOptions.solve_volatilities(interest_rate, volatilities, time_to_maturity, time_partition_size,
+                                                spatial_partition_size)
+        coarse_grids = AsianOptions.solve_volatilities(interest_rate, volatilities, time_to_maturity,
+                                                       time_partition_size // 2, spatial_partition_size // 2) \
+            if richardson else grids
+        solved = {volatility: (grid, coarse) for volatility, grid, coarse in zip(volatilities, grids, coarse_grids)}
+        for index in indices:
+            initial_price, strike_price, _, volatility, _, is_call = contracts[index]
+            grid, coarse = solved[volatility]
+            option_type = 'call' if is_call else 'put'
+            prices[index] = grid.prices(strike_price, initial_price, option_type, interpolation)
+            if richardson:
+                extrapolated = AsianOptions.richardson_prices(grid, coarse, strike_price, initial_price, option_type,
+                                                              interpolation)
+                prices[index], errors[index] = extrapolated, abs(extrapolated - prices[index])
+    return prices, errors
+
+
+def cvmc_fallback(contracts, N=500, n=10000, chunk_size=None, seed=None, control_variate='optimal',
+                  sampling='standard'):
+    ''' CVMC prices and conf95 of the same contracts, those on one underlying sharing their paths (see price_book) '''
+    options = [(CVMCOptions.CVMCAsianCallOption if is_call else CVMCOptions.CVMCAsianPutOption)(
+                   initial_price, volatility, interest_rate, time_to_maturity, strike_price=strike_price, N=N, n=n)
+               for initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call in contracts]
+    results = CVMCOptions.price_book(options, chunk_size=chunk_size, seed=seed, control_variate=control_variate,
+                                     sampling=sampling)
+    return np.array([price for price, _ in results]), np.array([conf95 for _, conf95 in results])
+
+
+def price_asian_options(initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call=True,
+                        fixings=None, tolerance=1e-3, relative=False, fallback=None, **settings) -> dict:
+    '''
+        Price Asian options by moment matching wherever its error estimate is within tolerance
+        (or tolerance times the price if relative) and by the fallback engine otherwise,
+        broadcasting the arguments against each other. fallback is 'FDS' (continuous average,
+        the default for fixings None) or 'CVMC' (the default with N = fixings), with settings
+        passed to fds_fallback or cvmc_fallback. The fallback must price the same contract as
+        the moment matching, so 'FDS' takes fixings None and 'CVMC' requires fixings. Returns a
+        dict of arrays: price, error (the moment matching error estimate, the CVMC conf95 or
+        the FDS Richardson correction) and method, the engine each contract was priced with
+    '''
+    fallback = fallback or ('FDS' if fixings is None else 'CVMC')
+    if fallback not in FALLBACKS:
+        raise ValueError(f'Unknown fallback "{fallback}", expected one of {FALLBACKS}')
+    if fallback == 'FDS' and fixings is not None:
+        raise ValueError(f'The FDS fallback prices the continuous average, not {fixings} fixings')
+    if fallback == 'CVMC':
+        if fixings is None:
+            raise ValueError('The CVMC fallback prices discrete fixings, give fixings')
+        if settings.setdefault('N', fixings) != fixings:
+            raise ValueError(f'The CVMC fallback N={settings["N"]} does not match fixings={fixings}')
+
+    price, error = moment_matching_prices(initial_price, strike_price, interest_rate, volatility, time_to_maturity,
+                                          is_call, fixings)
+    arguments = np.broadcast_arrays(*(np.asarray(argument, dtype=np.float64) for argument in
+                                      (initial_price, strike_price, interest_rate, volatility, time_to_maturity)),
+                                    np.asarray(is_call, dtype=np.bool_))
+    shape = np.shape(price)
+    price, error = np.ravel(price).copy(), np.ravel(error).copy()
+    method = np.full(len(price), 'moment matching', dtype=object)
+
+    rejected = np.flatnonzero(error > (tolerance * np.abs(price) if relative else tolerance))
+    if len(rejected):
+        contracts = list(zip(*(argument.ravel()[rejected].tolist() for argument in arguments)))
+        fallback_function = fds_fallback if fallback == 'FDS' else cvmc_fallback
+        price[rejected], error[rejected] = fallback_function(contracts, **settings)
+        method[rejected] = fallback
+    return {'price': price.reshape(shape)[()], 'error': error.reshape(shape)[()], 'method': method.reshape(shape)[()]}
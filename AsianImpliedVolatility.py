@@ -0,0 +1,193 @@
+import AsianOptions
+import numpy as np
+
+
+class AsianPriceTable(object):
+    '''
+        FDS prices of the Asian call and put per unit initial price over a grid of
+        (moneyness K/S0, volatility, maturity) at one interest rate. The price is homogeneous
+        in (S0, K), so the table prices any contract with moneyness, volatility and maturity
+        inside the grid by interpolation, and inverts quoted prices to implied volatilities
+    '''
+    OPTION_TYPES = AsianOptions.AsianOptionGrid.OPTION_TYPES
+    # Nodes per axis each interpolation method of RegularGridInterpolator needs
+    MIN_NODES = {'nearest': 1, 'linear': 1, 'slinear': 2, 'cubic': 4, 'quintic': 6, 'pchip': 4}
+
+    def __init__(self, interest_rate, moneyness, volatilities, maturities, prices, time_partition_size,
+                 spatial_partition_size, interpolation='cubic'):
+        super(AsianPriceTable, self).__init__()
+        self.check_nodes(interpolation, moneyness, volatilities, maturities)
+        self.interest_rate = interest_rate
+        # FDS resolution the prices were solved at
+        self.time_partition_size = time_partition_size
+        self.spatial_partition_size = spatial_partition_size
+        self.moneyness = np.asarray(moneyness, dtype=np.float64)
+        self.volatilities = np.asarray(volatilities, dtype=np.float64)
+        self.maturities = np.asarray(maturities, dtype=np.float64)
+        # prices[option, moneyness, volatility, maturity], option indexed like OPTION_TYPES
+        self.prices = np.asarray(prices, dtype=np.float64)
+        from scipy.interpolate import RegularGridInterpolator
+        self.interpolators = [RegularGridInterpolator((self.moneyness, self.volatilities, self.maturities),
+                                                      self.prices[k], method=interpolation, bounds_error=False,
+                                                      fill_value=np.nan)
+                              for k in range(len(self.OPTION_TYPES))]
+
+    @classmethod
+    def build(cls, interest_rate, moneyness, volatilities, maturities, time_partition_size=100,
+              spatial_partition_size=500, interpolation='cubic'):
+        '''
+            Table from one batched FDS solve of all volatilities per maturity, each grid pricing
+            all moneyness values at once
+        '''
+        cls.check_nodes(interpolation, moneyness, volatilities, maturities)
+        moneyness = np.asarray(moneyness, dtype=np.float64)
+        prices = np.empty((len(cls.OPTION_TYPES), len(moneyness), len(volatilities), len(maturities)))
+        for k, time_to_maturity in enumerate(maturities):
+            grids = AsianOptions.solve_volatilities(interest_rate, volatilities, time_to_maturity, time_partition_size,
+                                                    spatial_partition_size)
+            for j, grid in enumerate(grids):
+                for i, option_type in enumerate(cls.OPTION_TYPES):
+                    prices[i, :, j, k] = grid.prices(moneyness, np.ones_like(moneyness), option_type)
+        return cls(interest_rate, moneyness, volatilities, maturities, prices, time_partition_size,
+                   spatial_partition_size, interpolation)
+
+    @classmethod
+    def check_nodes(cls, interpolation, moneyness, volatilities, maturities):
+        if interpolation not in cls.MIN_NODES:
+            raise ValueError(f'Unknown interpolation "{interpolation}", expected one of {list(cls.MIN_NODES)}')
+        counts = {'moneyness': len(moneyness), 'volatilities': len(volatilities), 'maturities': len(maturities)}
+        short = {axis: count for axis, count in counts.items() if count < cls.MIN_NODES[interpolation]}
+        if short:
+            raise ValueError(f'Interpolation "{interpolation}" needs at least {cls.MIN_NODES[interpolation]} nodes per '
+                             f'axis, got {short}')
+
+    def save(self, path):
+        np.savez(path, interest_rate=self.interest_rate, moneyness=self.moneyness, volatilities=self.volatilities,
+                 maturities=self.maturities, prices=self.prices, time_partition_size=self.time_partition_size,
+                 spatial_partition_size=self.spatial_partition_size)
+
+    @classmethod
+    def load(cls, path, interpolation='cubic'):
+        with np.load(path) as data:
+            return cls(float(data['interest_rate']), data['moneyness'], data['volatilities'], data['maturities'],
+                       data['prices'], int(data['time_partition_size']), int(data['spatial_partition_size']),
+                       interpolation)
+
+    def interpolator(self, option_type='call'):
+        if option_type not in self.OPTION_TYPES:
+            raise ValueError(f'Unknown option type "{option_type}", expected one of {self.OPTION_TYPES}')
+        return self.interpolators[self.OPTION_TYPES.index(option_type)]
+
+    def check_rate(self, interest_rate):
+        if interest_rate is not None and interest_rate != self.interest_rate:
+            raise ValueError(f'Table built for interest rate {self.interest_rate}, not {interest_rate}')
+
+    def price(self, initial_price, strike_price, volatility, time_to_maturity, option_type='call', interest_rate=None):
+        ''' Interpolated prices, broadcasting the arguments against each other, nan outside the grid '''
+        self.check_rate(interest_rate)
+        initial_price, strike_price, volatility, time_to_maturity = np.broadcast_arrays(
+            *(np.asarray(argument, dtype=np.float64) for argument in
+              (initial_price, strike_price, volatility, time_to_maturity)))
+        shape = initial_price.shape
+        points = np.stack((strike_price / initial_price, volatility, time_to_maturity), axis=-1).reshape(-1, 3)
+        return (initial_price * self.interpolator(option_type)(points).reshape(shape))[()]
+
+    def implied_volatility(self, price, initial_price, strike_price, time_to_maturity, option_type='call',
+                           interest_rate=None, tolerance=1e-10, max_iterations=20):
+        '''
+            Implied volatilities of quoted Asian prices, broadcasting the arguments. The price
+            curve of every quote is interpolated at the volatility nodes of the table to find
+            the bracketing nodes, where the price is increasing in the volatility, and the root
+            of the interpolated price is then located by a modified regula falsi.
+            Returns the volatilities and convergence flags; quotes outside the grid or the
+            price range of the table give nan and False
+        '''
+        self.check_rate(interest_rate)
+        arguments = np.broadcast_arrays(*(np.asarray(argument, dtype=np.float64) for argument in
+                                          (price, initial_price, strike_price, time_to_maturity)))
+        shape = arguments[0].shape
+        price, initial_price, strike_price, time_to_maturity = [argument.ravel() for argument in arguments]
+        interpolator = self.interpolator(option_type)
+        moneyness = strike_price / initial_price
+        target = price / initial_price
+
+        def unit_price(volatility, active=slice(None)):
+            return interpolator(np.stack((moneyness[active], volatility, time_to_maturity[active]), axis=-1))
+
+        # Price curves at the volatility nodes, one row per quote
+        nodes = len(self.volatilities)
+        curves = interpolator(np.stack(np.broadcast_arrays(moneyness[:, None], self.volatilities[None, :],
+                                                           time_to_maturity[:, None]), axis=-1))
+        index = np.sum(curves < target[:, None], axis=1) - 1
+        valid = (index >= 0) & (index < nodes - 1)
+        index = np.clip(index, 0, nodes - 2)
+        rows = np.arange(len(target))
+        left, right = self.volatilities[index], self.volatilities[index + 1]
+        left_error = curves[rows, index] - target
+        right_error = curves[rows, index + 1] - target
+
+        volatility = np.full(len(target), np.nan)
+        converged = np.zeros(len(target), dtype=np.bool_)
+        side = np.zeros(len(target), dtype=np.int8)
+        active = np.flatnonzero(valid)
+        for _ in range(max_iterations):
+            if len(active) == 0:
+                break
+            with np.errstate(divide='ignore', invalid='ignore'):
+                candidate = (left[active] * right_error[active] - right[active] * left_error[active]) / \
+                            (right_error[active] - left_error[active])
+            candidate = np.where(np.isfinite(candidate), np.clip(candidate, left[active], right[active]),
+                                 0.5 * (left[active] + right[active]))
+            error = unit_price(candidate, active) - target[active]
+            volatility[active] = candidate
+
+            # Illinois: move the bracket end on the side of the candidate, halving the error kept
+            # at the other end when the same end moved twice in a row
+            below = error < 0
+            left_error[active] = np.where(below, error, np.where(side[active] > 0, 0.5, 1) * left_error[active])
+            right_error[active] = np.where(below, np.where(side[active] < 0, 0.5, 1) * right_error[active], error)
+            left[active] = np.where(below, candidate, left[active])
+            right[active] = np.where(below, right[active], candidate)
+            side[active] = np.where(below, -1, 1)
+
+            done = np.abs(error) <= tolerance * target[active]
+            converged[active[done]] = True
+            active = active[~done]
+        return volatility.reshape(shape)[()], converged.reshape(shape)[()]
+
+
+def error_report(table, samples=20, seed=0, time_partition_size=None, spatial_partition_size=None,
+                 option_type='call'):
+    '''
+        Price and implied volatility errors of the option_type table against direct FDS solves
+        at points drawn uniformly inside the table (solved at the table resolution unless
+        given). The implied volatility error is that of inverting the directly solved price.
+        Prints a summary and returns the errors per point
+    '''
+    if option_type not in table.OPTION_TYPES:
+        raise ValueError(f'Unknown option type "{option_type}", expected one of {table.OPTION_TYPES}')
+    option_class = AsianOptions.AsianCallOption if option_type == 'call' else AsianOptions.AsianPutOption
+    rng = np.random.default_rng(seed)
+    report = {'moneyness': rng.uniform(table.moneyness[0], table.moneyness[-1], samples),
+              'volatility': rng.uniform(table.volatilities[0], table.volatilities[-1], samples),
+              'time_to_maturity': rng.uniform(table.maturities[0], table.maturities[-1], samples)}
+    for key in ('price', 'price error', 'volatility error'):
+        report[key] = np.empty(samples)
+    for i in range(samples):
+        option = option_class(initial_price=1, strike_price=report['moneyness'][i],
+                              interest_rate=table.interest_rate, volatility=report['volatility'][i],
+                              time_to_maturity=report['time_to_maturity'][i],
+                              time_partition_size=time_partition_size or table.time_partition_size,
+                              spatial_partition_size=spatial_partition_size or table.spatial_partition_size)
+        report['price'][i] = option.solve()
+    report['price error'] = table.price(1, report['moneyness'], report['volatility'], report['time_to_maturity'],
+                                        option_type) - report['price']
+    implied, _ = table.implied_volatility(report['price'], 1, report['moneyness'], report['time_to_maturity'],
+                                          option_type)
+    report['volatility error'] = implied - report['volatility']
+
+    print(f'{"":>18} {"median":>10} {"max":>10}')
+    for key in ('price error', 'volatility error'):
+        errors = np.abs(report[key])
+        print(f'{key:>18} {np.nanmedian(errors):10.2e} {np.nanmax(errors):10.2e}')
+    return report
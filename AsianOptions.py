@@ -1,6 +1,481 @@
 import numpy as np
+from collections import OrderedDict
+from functools import partial
+from Instrumentation import NO_STATS
+
+# scipy is imported where it is first needed, so importing the pricers stays cheap
+
+
+def tridiagonal_solve(lower, diagonal, upper, rhs, solve_banded=None):
+    ''' Solve A x = rhs for a tridiagonal A given by its three diagonals as 1-D arrays,
+        where lower[j] = A[j, j-1] and upper[j] = A[j, j+1] (lower[0] and upper[-1] unused).
+        Time stepping loops pass scipy's solve_banded in, resolved once per solve
+    '''
+    banded = np.empty((3, len(diagonal)))
+    banded[0, 1:] = upper[:-1]
+    banded[1] = diagonal
+    banded[2, :-1] = lower[1:]
+    if solve_banded is None:
+        from scipy.linalg import solve_banded
+    return solve_banded((1, 1), banded, rhs, overwrite_ab=True, check_finite=False)
+
+
+def tridiagonal_matvec(lower, diagonal, upper, x):
+    ''' Product A x for a tridiagonal A given by its three diagonals (same layout as above),
+        where x is a vector or a matrix with one right-hand side per column
+    '''
+    if x.ndim > 1:
+        lower, diagonal, upper = lower[:, None], diagonal[:, None], upper[:, None]
+    y = diagonal * x
+    y[1:] += lower[1:] * x[:-1]
+    y[:-1] += upper[:-1] * x[1:]
+    return y
+
+
+def banded_step(u_prev, arg, b, solve_banded=None):
+    ''' One Crank-Nicolson step with the three diagonals kept as 1-D arrays, O(M) '''
+    rhs = tridiagonal_matvec(arg, 1 - 2 * arg, arg, u_prev) + b
+    return tridiagonal_solve(-arg, 1 + 2 * arg, -arg, rhs, solve_banded)
+
+
+def dense_step(u_prev, arg, b):
+    ''' One Crank-Nicolson step with dense matrices and explicit inverses, O(M^3).
+        Kept as the reference implementation for validation and benchmarking
+    '''
+    size = len(arg)
+
+    # Creating matrices and diagonals
+    A_forw = np.zeros((size, size)) + np.diag(1-2*arg)
+    A_backw = np.zeros((size, size)) + np.diag(1+2*arg)
+
+    # Non-diagonals
+    for j in range(size-1):
+        A_forw[j+1, j] = arg[j+1]
+        A_forw[j, j+1] = arg[j]
+
+        A_backw[j+1, j] = -arg[j+1]
+        A_backw[j, j+1] = -arg[j]
+
+    # Solving (row vector form)
+    matrices = np.matmul(u_prev, np.matmul(np.transpose(np.linalg.inv(A_backw)), np.transpose(A_forw)))
+    b_vectors = np.matmul(b, np.transpose(np.linalg.inv(A_backw)))
+    return matrices + b_vectors
+
+
+def batched_banded_step(u_prev, arg, b, solve_banded=None):
+    '''
+        One Crank-Nicolson step of several independent systems at once, with arg, u_prev and
+        b of shape (systems, nodes). The systems are chained into one block diagonal
+        tridiagonal matrix (no coupling between the blocks), so the whole batch is a single
+        banded solve
+    '''
+    systems, size = arg.shape
+    rhs = (1 - 2 * arg) * u_prev + b
+    rhs[:, 1:] += arg[:, 1:] * u_prev[:, :-1]
+    rhs[:, :-1] += arg[:, :-1] * u_prev[:, 1:]
+
+    banded = np.zeros((3, systems, size))
+    banded[0, :, 1:] = -arg[:, :-1]
+    banded[1] = 1 + 2 * arg
+    banded[2, :, :-1] = -arg[:, 1:]
+    if solve_banded is None:
+        from scipy.linalg import solve_banded
+    x = solve_banded((1, 1), banded.reshape(3, -1), rhs.reshape(-1), overwrite_ab=True, overwrite_b=True,
+                     check_finite=False)
+    return x.reshape(rhs.shape)
+
+
+STEPS = {'banded': banded_step, 'dense': dense_step}
+
+
+class OperatorCache(object):
+    '''
+        Bounded least recently used cache with hit and miss counters, used for the
+        precomputed time stepping coefficients of the Asian PDE solver. Entries (tuples of
+        arrays) are evicted beyond maxsize entries or max_bytes in total, and an entry larger
+        than max_bytes on its own is returned without being cached
+    '''
+    def __init__(self, maxsize=16, max_bytes=256 * 2**20):
+        super(OperatorCache, self).__init__()
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def entry_bytes(value) -> int:
+        return sum(array.nbytes for array in value)
+
+    def get(self, key, factory):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = factory()
+        size = self.entry_bytes(value)
+        if size > self.max_bytes:
+            return value
+        self.entries[key] = value
+        self.nbytes += size
+        while len(self.entries) > self.maxsize or self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= self.entry_bytes(evicted)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize,
+                'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+operator_cache = OperatorCache()
+
+
+def time_step_coefficients(interest_rate, time_to_maturity, time_partition_size, spatial_partition_size, spatial_size):
+    '''
+        Spatial grid and the volatility independent coefficients of every time step, i.e. the
+        gamma schedule squared against the interior nodes, (gamma_forward - z)^2 with one row
+        per step, and the matching boundary terms. Cached in operator_cache, so repeated solves
+        on the same grid, rate and maturity (a volatility sweep) only scale them by sigma^2
+    '''
+    def factory():
+        dt = time_to_maturity / time_partition_size
+        dz = 2 * (spatial_size / spatial_partition_size)
+        spatial = -spatial_size + np.arange(spatial_partition_size+1) * dz
+        time = np.arange(time_partition_size+1) * dt
+
+        # Gamma functions
+        gamma = (1 - np.exp(-interest_rate * time)) / (interest_rate * time_to_maturity)
+        gamma_forward, gamma_backward = gamma[:-1], gamma[1:]
+
+        interior = (gamma_forward[:, None] - spatial[1:-1])**2
+        boundary = (gamma_forward - spatial[-1])**2 + (gamma_backward - spatial[-1])**2
+        for array in (spatial, interior, boundary):
+            array.flags.writeable = False
+        return spatial, interior, boundary
+
+    key = (interest_rate, time_to_maturity, time_partition_size, spatial_partition_size, spatial_size)
+    return operator_cache.get(key, factory)
+
+
+def clustered_nodes(lower, upper, size, centers, concentration):
+    '''
+        size+1 nodes on [lower, upper] with density proportional to the sum over the centers of
+        1 / sqrt(concentration^2 + (z - center)^2), i.e. sinh stretched around every center
+        (smaller concentration clusters tighter), from inverting the cumulative density, a sum of arcsinh
+    '''
+    fine = np.linspace(lower, upper, 64 * size + 1)
+    cumulative = np.sum([np.arcsinh((fine - center) / concentration) for center in set(centers)], axis=0)
+    return np.interp(np.linspace(cumulative[0], cumulative[-1], size + 1), cumulative, fine)
+
+
+def spatial_value(strike_price, initial_price, interest_rate, time_to_maturity, option_type='call'):
+    ''' Spatial value z from theorem (Q(0) = 0), element-wise over strikes and initial prices '''
+    sign = 1 if option_type == 'call' else -1
+    z_left = 1 / (interest_rate * time_to_maturity) * (1 - np.exp(-interest_rate * time_to_maturity))
+    z_right = -strike_price * np.exp(-interest_rate * time_to_maturity) / initial_price
+    return sign * (z_left + z_right)
+
+
+class AsianOptionGrid(object):
+    '''
+        Finite difference scheme (Crank-Nicolson) for the arithmetic Asian option PDE in
+        the reduced variable z. The grid is solved for the call and puts are priced from it
+        by put-call parity (see prices).
+        The solution depends on the strike and the initial price only through the spatial
+        value z, so one solved grid prices any number of (strike, spot) pairs.
+        By default the grid is uniform in z and t. With a concentration the z nodes cluster
+        around the centers (the payoff kink z = 0 unless given, see clustered_nodes), with
+        time_grading p the time nodes are T (i/N)^p, small steps where the kink is still
+        sharp, and the first rannacher_steps steps are taken as two implicit Euler half
+        steps to damp the kink. Such grids are stepped by a Crank-Nicolson scheme for the
+        general three point operator, second order in both steps (see solve_general)
+    '''
+    OPTION_TYPES = ('call', 'put')
+
+    def __init__(self, interest_rate,
+                 volatility,
+                 time_to_maturity: int,
+                 time_partition_size: int,
+                 spatial_partition_size: int,
+                 spatial_size=3,
+                 concentration=None,
+                 centers=(0.0,),
+                 time_grading=1.0,
+                 rannacher_steps=0):
+        super(AsianOptionGrid, self).__init__()
+        self.interest_rate = interest_rate
+        self.volatility = volatility
+        self.time_to_maturity = time_to_maturity
+        self.time_partition_size = time_partition_size
+        self.spatial_partition_size = spatial_partition_size
+        self.spatial_size = spatial_size
+        self.concentration = concentration
+        self.centers = tuple(centers)
+        self.time_grading = time_grading
+        self.rannacher_steps = rannacher_steps
+
+    def uniform(self) -> bool:
+        return self.concentration is None and self.time_grading == 1 and self.rannacher_steps == 0
+
+    def order(self) -> int:
+        ''' Order of the leading discretization error, for Richardson extrapolation '''
+        return 1 if self.uniform() else 2
+
+    def spatial_nodes(self):
+        if self.concentration is None:
+            dz = 2 * (self.spatial_size / self.spatial_partition_size)
+            return -self.spatial_size + np.arange(self.spatial_partition_size+1) * dz
+        return clustered_nodes(-self.spatial_size, self.spatial_size, self.spatial_partition_size, self.centers,
+                               self.concentration)
+
+    def time_nodes(self):
+        return self.time_to_maturity * (np.arange(self.time_partition_size+1) / self.time_partition_size) ** \
+            self.time_grading
+
+    def solve(self, method='banded', out=None, stats=None):
+        '''
+            Step the scheme to maturity, writing u into out (e.g. a memory-mapped array) if given.
+            stats (an Instrumentation.SolverStats) records the assembly and solve phases, the
+            size of u and the number of time steps
+        '''
+        if method not in STEPS:
+            raise ValueError(f'Unknown method "{method}", expected one of {list(STEPS)}')
+        if not self.uniform():
+            if method != 'banded':
+                raise ValueError(f'Method "{method}" needs the uniform grid, use "banded"')
+            return self.solve_general(out, stats)
+        step = STEPS[method]
+        if step is banded_step:
+            from scipy.linalg import solve_banded
+            step = partial(banded_step, solve_banded=solve_banded)
+        stats = stats or NO_STATS
+
+        with stats.phase('assembly'):
+            dt = self.time_to_maturity / self.time_partition_size
+            dz = 2 * (self.spatial_size / self.spatial_partition_size)
+            d = dt / dz ** 2
+            spatial, interior, boundary = time_step_coefficients(self.interest_rate, self.time_to_maturity,
+                                                                 self.time_partition_size, self.spatial_partition_size,
+                                                                 self.spatial_size)
+
+            # Solution for the call
+            u = np.zeros((self.time_partition_size+1, self.spatial_partition_size+1)) if out is None else out
+            stats.allocate('u', u)
+
+            # Initial conditions and boundary conditions
+            u[0] = np.maximum(spatial, 0)
+            u[1:, 0] = 0
+            u[1:, -1] = self.spatial_size
+
+            # Argument for matrices and boundary vector (arguments but with the last spatial partition element)
+            scale = 0.5 * d * (self.volatility**2 / 2)
+            args = stats.allocate('coefficients', scale * interior)
+            boundary_terms = self.spatial_size * scale * boundary
+
+        with stats.phase('solve'):
+            b = np.zeros(self.spatial_partition_size-1)
+            for i in range(1, self.time_partition_size+1):
+                b[-1] = boundary_terms[i-1]
+
+                # Solving
+                u[i, 1:-1] = step(u[i-1, 1:-1], args[i-1], b)
+            stats.iterate('time steps', self.time_partition_size)
+
+        self.spatial = spatial
+        self.u = u
+        return self
+
+    def solve_general(self, out=None, stats=None):
+        '''
+            Crank-Nicolson steps on the time and z nodes, with the second derivative on the
+            non-uniform nodes z_{j-1}, z_j, z_{j+1} (spacings h_{j-1}, h_j)
+                u_zz = 2 / (h_{j-1} + h_j) ((u_{j+1} - u_j) / h_j - (u_j - u_{j-1}) / h_{j-1})
+            and the coefficient (sigma^2 / 2) (gamma(t) - z)^2 taken at both ends of every step.
+            The first rannacher_steps steps are two implicit Euler half steps each. Boundary
+            conditions, out and stats as in solve
+        '''
+        stats = stats or NO_STATS
+        with stats.phase('assembly'):
+            spatial = self.spatial_nodes()
+            times = self.time_nodes()
+            h = np.diff(spatial)
+            lower_weight = 2 / (h[:-1] * (h[:-1] + h[1:]))
+            upper_weight = 2 / (h[1:] * (h[:-1] + h[1:]))
+
+            u = np.zeros((self.time_partition_size+1, self.spatial_partition_size+1)) if out is None else out
+            stats.allocate('u', u)
+            u[0] = np.maximum(spatial, 0)
+            # Boundary values at z_0 and z_M, as in solve
+            left, right = 0, self.spatial_size
+            u[1:, 0] = left
+            u[1:, -1] = right
+
+        def operator(t):
+            ''' Diagonals of the operator on the interior nodes at time t and its boundary terms '''
+            gamma = (1 - np.exp(-self.interest_rate * t)) / (self.interest_rate * self.time_to_maturity)
+            coefficient = self.volatility**2 / 2 * (gamma - spatial[1:-1])**2
+            lower, upper = coefficient * lower_weight, coefficient * upper_weight
+            boundary = np.zeros(self.spatial_partition_size-1)
+            boundary[0] = lower[0] * left
+            boundary[-1] = upper[-1] * right
+            return lower, -(lower + upper), upper, boundary
+
+        def theta_step(u_prev, dt, start, end, theta):
+            ''' (I - theta dt L(end)) u = (I + (1 - theta) dt L(start)) u_prev + boundary terms, L from operator '''
+            lower, diagonal, upper, boundary = end
+            rhs = u_prev + theta * dt * boundary
+            if theta < 1:
+                start_lower, start_diagonal, start_upper, start_boundary = start
+                rhs += (1 - theta) * dt * (tridiagonal_matvec(start_lower, start_diagonal, start_upper, u_prev) +
+                                           start_boundary)
+            return tridiagonal_solve(-theta * dt * lower, 1 - theta * dt * diagonal, -theta * dt * upper, rhs,
+                                     solve_banded)
+
+        from scipy.linalg import solve_banded
+
+        with stats.phase('solve'):
+            # The operator at the end of a step is reused at the start of the next
+            previous = operator(times[0])
+            for i in range(1, self.time_partition_size+1):
+                dt = times[i] - times[i-1]
+                current = operator(times[i])
+                if i <= self.rannacher_steps:
+                    middle = operator(times[i-1] + dt / 2)
+                    u[i, 1:-1] = theta_step(theta_step(u[i-1, 1:-1], dt / 2, None, middle, 1), dt / 2, None, current, 1)
+                else:
+                    u[i, 1:-1] = theta_step(u[i-1, 1:-1], dt, previous, current, 0.5)
+                previous = current
+            stats.iterate('time steps', self.time_partition_size)
+
+        self.spatial = spatial
+        self.u = u
+        return self
+
+    def load(self, u):
+        ''' Use an already solved u (e.g. memory-mapped from a ResultStore) instead of solving '''
+        self.spatial = self.spatial_nodes()
+        self.u = u
+        return self
+
+    def spatial_value(self, strike_price, initial_price, option_type='call'):
+        ''' Spatial value z of (strike, initial price) pairs on this grid, see spatial_value '''
+        return spatial_value(strike_price, initial_price, self.interest_rate, self.time_to_maturity, option_type)
+
+    def final_slice(self, z, interpolation='linear'):
+        '''
+            Call solution at maturity evaluated at the spatial values z, located by binary search:
+            'nearest' takes the closest node, 'linear' and 'cubic' interpolate the final slice
+            (piecewise linear, cubic spline); values outside the grid take the boundary nodes
+        '''
+        values = self.u[-1]
+        z = np.clip(z, self.spatial[0], self.spatial[-1])
+        if interpolation == 'nearest':
+            k = np.clip(np.searchsorted(self.spatial, z), 1, self.spatial_partition_size)
+            k = np.where(z - self.spatial[k-1] <= self.spatial[k] - z, k - 1, k)
+            return values[k]
+        if interpolation == 'linear':
+            return np.interp(z, self.spatial, values)
+        if interpolation == 'cubic':
+            from scipy.interpolate import CubicSpline
+            return CubicSpline(self.spatial, values)(z)
+        raise ValueError(f'Unknown interpolation "{interpolation}", expected nearest, linear or cubic')
+
+    def prices(self, strike_prices, initial_prices, option_type='call', interpolation='linear', stats=None):
+        '''
+            Prices for arrays of (strike, initial price) pairs from the solved grid. Puts come
+            from the call by the put-call parity of the continuous average,
+                call - put = S0 (1 - e^{-rT}) / (rT) - K e^{-rT} = S0 z
+            with z the spatial value of the call
+        '''
+        if option_type not in self.OPTION_TYPES:
+            raise ValueError(f'Unknown option type "{option_type}", expected one of {self.OPTION_TYPES}')
+        with (stats or NO_STATS).phase('interpolation'):
+            strike_prices = np.asarray(strike_prices, dtype=np.float64)
+            initial_prices = np.asarray(initial_prices, dtype=np.float64)
+            z = self.spatial_value(strike_prices, initial_prices, 'call')
+            value = self.final_slice(z, interpolation)
+            price = initial_prices * (value if option_type == 'call' else value - z)
+        return price[()]
+
+    def coarsened(self):
+        ''' Unsolved grid with half the time and spatial partition sizes, for Richardson extrapolation '''
+        return AsianOptionGrid(self.interest_rate, self.volatility, self.time_to_maturity,
+                               self.time_partition_size // 2, self.spatial_partition_size // 2, self.spatial_size,
+                               self.concentration, self.centers, self.time_grading, self.rannacher_steps)
+
+
+def solve_volatilities(interest_rate, volatilities, time_to_maturity, time_partition_size, spatial_partition_size,
+                       spatial_size=3, batch_nodes=16384, stats=None) -> list:
+    '''
+        AsianOptionGrid per volatility, stepped together: the grid and gamma schedule are
+        shared and only the diffusion coefficient scales with sigma^2, so every time step is
+        one batched banded solve over the volatilities (see batched_banded_step). The
+        volatilities are stepped in batches of about batch_nodes spatial nodes, beyond which
+        the step arrays outgrow the cache and larger batches only get slower. Only the final
+        slice of each grid is kept, which is all pricing needs, so the grids price like
+        solved ones but cannot be stored in a ResultStore
+    '''
+    stats = stats or NO_STATS
+    volatilities = np.asarray(volatilities, dtype=np.float64)
+
+    with stats.phase('assembly'):
+        dt = time_to_maturity / time_partition_size
+        dz = 2 * (spatial_size / spatial_partition_size)
+        d = dt / dz ** 2
+        spatial, interior, boundary = time_step_coefficients(interest_rate, time_to_maturity, time_partition_size,
+                                                             spatial_partition_size, spatial_size)
+
+        # Current slice of the call for every volatility
+        u = stats.allocate('u', np.empty((len(volatilities), spatial_partition_size+1)))
+        u[:] = np.maximum(spatial, 0)
+        scales = 0.5 * d * (volatilities**2 / 2)
+        b = np.zeros((len(volatilities), spatial_partition_size-1))
+
+    from scipy.linalg import solve_banded
+    with stats.phase('solve'):
+        # Boundary conditions as in AsianOptionGrid.solve
+        u[:, 0], u[:, -1] = 0, spatial_size
+        batch_size = max(1, batch_nodes // spatial_partition_size)
+        for start in range(0, len(volatilities), batch_size):
+            batch = slice(start, start + batch_size)
+            for i in range(1, time_partition_size+1):
+                b[batch, -1] = spatial_size * scales[batch] * boundary[i-1]
+                u[batch, 1:-1] = batched_banded_step(u[batch, 1:-1], scales[batch, None] * interior[i-1], b[batch],
+                                                     solve_banded)
+            stats.iterate('time steps', time_partition_size)
+
+    return [AsianOptionGrid(interest_rate, volatility, time_to_maturity, time_partition_size, spatial_partition_size,
+                            spatial_size).load(u[k][None])
+            for k, volatility in enumerate(volatilities)]
+
+
+def richardson_prices(fine, coarse, strike_prices, initial_prices, option_type='call', interpolation='linear',
+                      order=None, stats=None):
+    '''
+        Richardson extrapolation (2^p P_fine - P_coarse) / (2^p - 1) of the prices from a solved
+        grid and a solved grid with half its partition sizes. The uniform scheme evaluates both
+        sides of every step at the forward gamma, so its leading error is first order in the
+        time step, while that of the non-uniform grids is second order; order defaults to
+        that of the fine grid (see AsianOptionGrid.order)
+    '''
+    factor = 2 ** (order or fine.order())
+    return (factor * fine.prices(strike_prices, initial_prices, option_type, interpolation, stats) -
+            coarse.prices(strike_prices, initial_prices, option_type, interpolation, stats)) / (factor - 1)
+
+
+class AsianOption(object):
+    ''' Single Asian option priced from its own AsianOptionGrid '''
+    option_type = None
 
-class AsianCallOption(object):
     def __init__(self, initial_price,
                  strike_price,
                  interest_rate,
@@ -8,7 +483,7 @@ class AsianCallOption(object):
                  time_to_maturity: int,
                  time_partition_size: int,
                  spatial_partition_size: int):
-        super(AsianCallOption, self).__init__()
+        super(AsianOption, self).__init__()
         self.initial_price = initial_price
         self.strike_price = strike_price
         self.interest_rate = interest_rate
@@ -17,75 +492,32 @@ class AsianCallOption(object):
         self.time_partition_size = time_partition_size
         self.spatial_partition_size = spatial_partition_size
 
-    def solve(self, spatial_size=3):
+    def solve(self, spatial_size=3, method='banded', interpolation='linear', richardson=False, stats=None,
+              concentration=None, time_grading=1.0, rannacher_steps=0):
+        '''
+            Price with the given final slice interpolation (see AsianOptionGrid.final_slice).
+            With richardson the price is extrapolated from this grid and one with half the
+            partition sizes (see richardson_prices). stats records the phases of the solve
+            (see AsianOptionGrid.solve). With a concentration the z nodes cluster around the
+            payoff kink and the (call) z of this option, time_grading and rannacher_steps grade the
+            time steps (see AsianOptionGrid)
+        '''
         self.spatial_size = spatial_size
+        # The grid is solved for the call (see AsianOptionGrid.prices), so the nodes cluster around the call z
+        target = spatial_value(self.strike_price, self.initial_price, self.interest_rate, self.time_to_maturity, 'call')
+        grid = AsianOptionGrid(self.interest_rate, self.volatility, self.time_to_maturity,
+                               self.time_partition_size, self.spatial_partition_size, spatial_size,
+                               concentration, (0.0, float(target)), time_grading, rannacher_steps)
+        grid.solve(method, stats=stats)
+        if richardson:
+            return richardson_prices(grid, grid.coarsened().solve(method, stats=stats), self.strike_price,
+                                     self.initial_price, self.option_type, interpolation, stats=stats)
+        return grid.prices(self.strike_price, self.initial_price, self.option_type, interpolation, stats)
 
-        dt = self.time_to_maturity / self.time_partition_size
-        dz = 2 * (self.spatial_size / self.spatial_partition_size)
-        d = dt / dz ** 2
-
-        u = np.zeros((self.time_partition_size+1, self.spatial_partition_size+1))
-        #time = np.mslice[0:dt:self.time_to_maturity]
-        spatial = np.array([-self.spatial_size+i*dz for i in range(self.spatial_partition_size+1)])
-        time = np.array([0+i*dt for i in range(self.time_partition_size+1)])
-
-
-        # Initial conditions and boundary conditions
-        for j in range(self.spatial_partition_size+1):
-            u[0, j] = np.max([spatial[j], 0])
-        u[1:, 0] = 0
-        u[1:, -1] = np.max([spatial[j], 0])
-
-        for i in range(1, self.time_partition_size+1):
-            # Gamma functions
-            gamma_forward = (1 - np.exp(-self.interest_rate * time[i-1])) / (self.interest_rate * self.time_to_maturity)
-            gamma_backward = (1 - np.exp(-self.interest_rate * time[i])) / (self.interest_rate * self.time_to_maturity)
-
-            # Argument for matrices
-            arg_A_forw = 0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[1:-1])**2
-            arg_A_backw = -0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[1:-1])**2
-
-
-            # Creating matrices and diagonals
-            A_forw = np.zeros((self.spatial_partition_size-1, self.spatial_partition_size-1)) + np.diag(1-2*arg_A_forw)
-            A_backw = np.zeros((self.spatial_partition_size-1, self.spatial_partition_size-1)) + np.diag(1-2*arg_A_backw)
-
-            # Non-diagonals
-            for j in range(self.spatial_partition_size-2):
-                A_forw[j+1, j] = arg_A_forw[j+1]
-                A_forw[j, j+1] = arg_A_forw[j]
-
-                A_backw[j+1, j] = arg_A_backw[j+1]
-                A_backw[j, j+1] = arg_A_backw[j]
-
-            # Boundary vector (arguments but with the last spatial partition element)
-            b_forw = np.zeros((self.spatial_partition_size-1))
-            b_backw = np.zeros((self.spatial_partition_size-1))
-            b_forw[-1] = self.spatial_size * 0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[-1])**2
-            b_backw[-1] = -self.spatial_size * 0.5 * d * (self.volatility**2 / 2) * (gamma_backward - spatial[-1])**2
 
-            # Solving
-            matrices = np.matmul(u[i-1, 1:-1], np.matmul(np.transpose(np.linalg.inv(A_backw)), np.transpose(A_forw)))
-            b_vectors = np.matmul(b_forw.T, np.transpose(np.linalg.inv(A_backw))) - np.matmul(b_backw.T, np.transpose(np.linalg.inv(A_backw)))
+class AsianCallOption(AsianOption):
+    option_type = 'call'
 
-            u[i, 1:-1] = matrices + b_vectors
-
-        # Compute spatial value from theorem (Q(0) = 0)
-        z_left = 1 / (self.interest_rate * self.time_to_maturity) * (1 - np.exp(-self.interest_rate * self.time_to_maturity))
-        z_right = -self.strike_price * np.exp(-self.interest_rate * self.time_to_maturity) / self.initial_price
-        z = z_left + z_right
-
-        # Interpolate to find closest possible
-        correct_z = 0
-        for k in range(self.spatial_partition_size):
-            if z >= spatial[k] and z <= spatial[k+1]:
-                correct_z = int(np.round((k + (k + 1)) / 2))
-
-        price = self.initial_price * u[-1, correct_z]
-        return price
-
-
-class AsianPutOption(object):
     def __init__(self, initial_price,
                  strike_price,
                  interest_rate,
@@ -93,75 +525,19 @@ class AsianPutOption(object):
                  time_to_maturity: int,
                  time_partition_size: int,
                  spatial_partition_size: int):
-        super(AsianPutOption, self).__init__()
-        self.initial_price = initial_price
-        self.strike_price = strike_price
-        self.interest_rate = interest_rate
-        self.volatility = volatility
-        self.time_to_maturity = time_to_maturity
-        self.time_partition_size = time_partition_size
-        self.spatial_partition_size = spatial_partition_size
+        super(AsianCallOption, self).__init__(initial_price, strike_price, interest_rate, volatility,
+                                              time_to_maturity, time_partition_size, spatial_partition_size)
 
-    def solve(self, spatial_size=3):
-        self.spatial_size = spatial_size
 
-        dt = self.time_to_maturity / self.time_partition_size
-        dz = 2 * (self.spatial_size / self.spatial_partition_size)
-        d = dt / dz ** 2
+class AsianPutOption(AsianOption):
+    option_type = 'put'
 
-        u = np.zeros((self.time_partition_size+1, self.spatial_partition_size+1))
-        #time = np.mslice[0:dt:self.time_to_maturity]
-        spatial = np.array([-self.spatial_size+i*dz for i in range(self.spatial_partition_size+1)])
-        time = np.array([0+i*dt for i in range(self.time_partition_size+1)])
-
-        # Initial conditions and boundary conditions
-        for j in range(self.spatial_partition_size+1):
-            u[0, j] = np.max([spatial[j], 0])
-        u[1:, 0] = self.spatial_size
-        u[1:, -1] = 0
-
-        for i in range(1, self.time_partition_size+1):
-            # Gamma functions
-            gamma_forward = (1 - np.exp(-self.interest_rate * time[i-1])) / (self.interest_rate * self.time_to_maturity)
-            gamma_backward = (1 - np.exp(-self.interest_rate * time[i])) / (self.interest_rate * self.time_to_maturity)
-
-            # Argument for matrices
-            arg_A_forw = 0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[1:-1])**2
-            arg_A_backw = -0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[1:-1])**2
-
-            # Creating matrices and diagonals
-            A_forw = np.zeros((self.spatial_partition_size-1, self.spatial_partition_size-1)) + np.diag(1-2*arg_A_forw)
-            A_backw = np.zeros((self.spatial_partition_size-1, self.spatial_partition_size-1)) + np.diag(1-2*arg_A_backw)
-
-            # Non-diagonals
-            for j in range(self.spatial_partition_size-2):
-                A_forw[j+1, j] = arg_A_forw[j+1]
-                A_forw[j, j+1] = arg_A_forw[j]
-
-                A_backw[j+1, j] = arg_A_backw[j+1]
-                A_backw[j, j+1] = arg_A_backw[j]
-
-            # Boundary vector (arguments but with the last spatial partition element)
-            b_forw = np.zeros((self.spatial_partition_size-1))
-            b_backw = np.zeros((self.spatial_partition_size-1))
-            b_forw[-1] = self.spatial_size * 0.5 * d * (self.volatility**2 / 2) * (gamma_forward - spatial[-1])**2
-            b_backw[-1] = -self.spatial_size * 0.5 * d * (self.volatility**2 / 2) * (gamma_backward - spatial[-1])**2
-
-            # Solving
-            matrices = np.matmul(u[i-1, 1:-1], np.matmul(np.transpose(np.linalg.inv(A_backw)), np.transpose(A_forw)))
-            b_vectors = np.matmul(b_forw.T, np.transpose(np.linalg.inv(A_backw))) - np.matmul(b_backw.T, np.transpose(np.linalg.inv(A_backw)))
-            u[i, 1:-1] = matrices + b_vectors
-
-        # Compute spatial value from theorem (Q(0) = 0)
-        z_left = -1 / (self.interest_rate * self.time_to_maturity) * (1 - np.exp(-self.interest_rate * self.time_to_maturity))
-        z_right = self.strike_price * np.exp(-self.interest_rate * self.time_to_maturity) / self.initial_price
-        z = z_left + z_right
-
-        # Interpolate to find closest possible
-        correct_z = 0
-        for k in range(self.spatial_partition_size):
-            if z >= spatial[k] and z <= spatial[k+1]:
-                correct_z = int(np.round((k + (k + 1)) / 2))
-
-        price = self.initial_price * u[-1, correct_z]
-        return price
\ No newline at end of file
+    def __init__(self, initial_price,
+                 strike_price,
+                 interest_rate,
+                 volatility,
+                 time_to_maturity: int,
+                 time_partition_size: int,
+                 spatial_partition_size: int):
+        super(AsianPutOption, self).__init__(initial_price, strike_price, interest_rate, volatility,
+                                             time_to_maturity, time_partition_size, spatial_partition_size)
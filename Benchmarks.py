@@ -0,0 +1,691 @@
+import AsianApproximations
+import AsianImpliedVolatility
+import AsianOptions
+import CVMCOptions
+import ParameterSweep
+import ResultStore
+import StandardEuropeanOptions
+import numpy as np
+import scipy.stats as stats
+import time
+import tracemalloc
+
+
+def time_call(function, *args, repeats=1, **kwargs):
+    ''' Best wall time (in seconds) over a number of repeats together with the last result '''
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def fds_solver(grids=((100, 500), (500, 1000)), initial_price=50, strike_price=50, interest_rate=0.05,
+               volatility=0.5, time_to_maturity=1, repeats=1):
+    '''
+        Banded (Thomas) time stepping against the dense inverse-based reference for the
+        (time_partition_size, spatial_partition_size) grids used by the comparison scripts
+    '''
+    print(f'{"grid":>12} {"dense [s]":>10} {"banded [s]":>10} {"speedup":>8} {"abs diff":>10}')
+    for time_partition_size, spatial_partition_size in grids:
+        option = AsianOptions.AsianCallOption(initial_price=initial_price, strike_price=strike_price,
+                                              interest_rate=interest_rate, volatility=volatility,
+                                              time_to_maturity=time_to_maturity,
+                                              time_partition_size=time_partition_size,
+                                              spatial_partition_size=spatial_partition_size)
+        dense_time, dense_price = time_call(option.solve, method='dense', repeats=repeats)
+        banded_time, banded_price = time_call(option.solve, method='banded', repeats=repeats)
+        print(f'{f"{time_partition_size}x{spatial_partition_size}":>12} {dense_time:10.3f} {banded_time:10.3f} '
+              f'{dense_time / banded_time:8.1f} {abs(dense_price - banded_price):10.2e}')
+
+
+def fds_operator_cache(volatilities=(0.1, 0.2, 0.3, 0.4, 0.5), time_partition_size=500, spatial_partition_size=1000,
+                       initial_price=50, strike_price=50, interest_rate=0.05, time_to_maturity=1):
+    ''' Volatility sweep with the time stepping coefficients rebuilt for every solve against cached '''
+    def sweep(cold):
+        for volatility in volatilities:
+            if cold:
+                AsianOptions.operator_cache.clear()
+            AsianOptions.AsianCallOption(initial_price=initial_price, strike_price=strike_price,
+                                         interest_rate=interest_rate, volatility=volatility,
+                                         time_to_maturity=time_to_maturity, time_partition_size=time_partition_size,
+                                         spatial_partition_size=spatial_partition_size).solve()
+
+    AsianOptions.operator_cache.clear()
+    cold_time, _ = time_call(sweep, True)
+    AsianOptions.operator_cache.clear()
+    warm_time, _ = time_call(sweep, False)
+    print(f'{len(volatilities)} solves on {time_partition_size}x{spatial_partition_size}: '
+          f'uncached {cold_time:.3f} s, cached {warm_time:.3f} s, {AsianOptions.operator_cache.info()}')
+
+
+def fds_volatility_batch(volatility_counts=(10, 100, 300), grids=((100, 200), (100, 500), (500, 1000)),
+                         initial_prices=(40, 50, 60), strike_price=50, interest_rate=0.05, time_to_maturity=1):
+    '''
+        Volatility sweep solved one AsianOptionGrid at a time against all volatilities stepped
+        together by solve_volatilities, each pricing calls at the initial prices
+    '''
+    print(f'{"grid":>12} {"vols":>5} {"loop [s]":>9} {"batched [s]":>11} {"speedup":>8} {"abs diff":>10}')
+    for time_partition_size, spatial_partition_size in grids:
+        for count in volatility_counts:
+            volatilities = np.linspace(0.05, 1, count)
+            strike_prices = np.full(len(initial_prices), strike_price)
+
+            def loop():
+                return [AsianOptions.AsianOptionGrid(interest_rate, volatility, time_to_maturity, time_partition_size,
+                                                     spatial_partition_size).solve().prices(strike_prices, initial_prices)
+                        for volatility in volatilities]
+
+            def batched():
+                return [grid.prices(strike_prices, initial_prices) for grid in
+                        AsianOptions.solve_volatilities(interest_rate, volatilities, time_to_maturity,
+                                                        time_partition_size, spatial_partition_size)]
+
+            loop_time, loop_prices = time_call(loop)
+            batched_time, batched_prices = time_call(batched)
+            print(f'{f"{time_partition_size}x{spatial_partition_size}":>12} {count:5d} {loop_time:9.3f} '
+                  f'{batched_time:11.3f} {loop_time / batched_time:8.1f} '
+                  f'{np.max(np.abs(np.array(loop_prices) - np.array(batched_prices))):10.2e}')
+
+def fds_nonuniform(cases=((50, 0.1), (50, 0.3), (40, 0.3), (60, 0.5)),
+                   configurations=(('uniform', 500, 1000, {}), ('uniform', 100, 200, {}),
+                                   ('clustered', 100, 200, dict(concentration=0.2)),
+                                   ('clustered', 50, 100, dict(concentration=0.2)),
+                                   ('clustered', 25, 200, dict(concentration=0.2)),
+                                   ('graded', 25, 200, dict(concentration=0.2, time_grading=2, rannacher_steps=2))),
+                   initial_price=50, interest_rate=0.05, time_to_maturity=1):
+    '''
+        Accuracy against runtime of the uniform grid and of z nodes clustered around the kink
+        and the target z (with graded time steps and a Rannacher start for 'graded'), as the
+        largest error over the (strike, volatility) cases against a Richardson extrapolated
+        clustered 1000x4000 solve, and the mean time per solve
+    '''
+    def option(strike_price, volatility, time_partition_size, spatial_partition_size):
+        return AsianOptions.AsianCallOption(initial_price=initial_price, strike_price=strike_price,
+                                            interest_rate=interest_rate, volatility=volatility,
+                                            time_to_maturity=time_to_maturity, time_partition_size=time_partition_size,
+                                            spatial_partition_size=spatial_partition_size)
+
+    references = [option(strike_price, volatility, 1000, 4000).solve(richardson=True, concentration=0.1)
+                  for strike_price, volatility in cases]
+    print(f'{"grid":>10} {"size":>9} {"max |error|":>12} {"time [s]":>9}')
+    for label, time_partition_size, spatial_partition_size, settings in configurations:
+        errors, times = [], []
+        for (strike_price, volatility), reference in zip(cases, references):
+            solve_time, price = time_call(option(strike_price, volatility, time_partition_size,
+                                                 spatial_partition_size).solve, repeats=3, **settings)
+            errors.append(abs(price - reference))
+            times.append(solve_time)
+        print(f'{label:>10} {f"{time_partition_size}x{spatial_partition_size}":>9} {max(errors):12.2e} '
+              f'{np.mean(times):9.4f}')
+
+def fds_convergence(grids=((25, 50), (50, 100), (100, 200), (200, 400), (400, 800), (500, 1000)),
+                    reference_grid=(3200, 6400), initial_price=50, strike_price=50, interest_rate=0.05,
+                    volatility=0.3, time_to_maturity=1, reference_paths=200000, reference_steps=1000, seed=0):
+    '''
+        Error and runtime of the FDS call price per final slice lookup and with Richardson
+        extrapolation, against a seeded CVMC reference and a Richardson-extrapolated FDS solve
+        on reference_grid (the CVMC estimate carries its own discretization bias from the
+        reference_steps monitoring dates)
+    '''
+    cvmc_price, cvmc_conf95 = CVMCOptions.CVMCAsianCallOption(
+        initial_price=initial_price, volatility=volatility, interest_rate=interest_rate,
+        time_to_maturity=time_to_maturity, strike_price=strike_price, N=reference_steps, n=reference_paths
+    ).compute(chunk_size=10000, seed=seed)
+
+    def option(grid):
+        return AsianOptions.AsianCallOption(initial_price=initial_price, strike_price=strike_price,
+                                            interest_rate=interest_rate, volatility=volatility,
+                                            time_to_maturity=time_to_maturity, time_partition_size=grid[0],
+                                            spatial_partition_size=grid[1])
+
+    fds_reference = option(reference_grid).solve(richardson=True)
+    print(f'CVMC reference {cvmc_price:.5f} +- {cvmc_conf95:.5f}, FDS reference {fds_reference:.5f}')
+    print(f'{"grid":>10} {"mode":>18} {"price":>9} {"err CVMC":>9} {"err FDS":>9} {"time [s]":>9}')
+    for grid in grids:
+        for mode, kwargs in [('nearest', dict(interpolation='nearest')),
+                             ('linear', dict(interpolation='linear')),
+                             ('cubic', dict(interpolation='cubic')),
+                             ('linear+richardson', dict(interpolation='linear', richardson=True))]:
+            solve_time, price = time_call(option(grid).solve, **kwargs)
+            print(f'{f"{grid[0]}x{grid[1]}":>10} {mode:>18} {price:9.5f} {abs(price - cvmc_price):9.2e} '
+                  f'{abs(price - fds_reference):9.2e} {solve_time:9.4f}')
+
+
+def black_scholes_chain(chain_sizes=(1000, 100000, 1000000), loop_size=1000, seed=0):
+    '''
+        Throughput (contracts/second) of the vectorized chain pricer, with and without the
+        Greeks, against creating one StandardCallOption/StandardPutOption object per contract
+    '''
+    rng = np.random.default_rng(seed)
+    print(f'{"contracts":>10} {"method":>8} {"time [s]":>10} {"contracts/s":>12}')
+    for size in chain_sizes:
+        chain = np.empty(size, dtype=StandardEuropeanOptions.CHAIN_DTYPE)
+        chain['initial_price'] = rng.uniform(50, 150, size)
+        chain['strike_price'] = rng.uniform(50, 150, size)
+        chain['interest_rate'] = rng.uniform(0, 0.1, size)
+        chain['volatility'] = rng.uniform(0.05, 1, size)
+        chain['time_to_maturity'] = rng.uniform(0.1, 5, size)
+        chain['is_call'] = rng.random(size) < 0.5
+
+        batch_time, _ = time_call(StandardEuropeanOptions.price_chain, chain, repeats=3)
+        print(f'{size:10d} {"batch":>8} {batch_time:10.4f} {size / batch_time:12.3e}')
+
+        greeks_time, _ = time_call(StandardEuropeanOptions.black_scholes_greeks, chain['initial_price'],
+                                   chain['strike_price'], chain['interest_rate'], chain['volatility'],
+                                   chain['time_to_maturity'], chain['is_call'], repeats=3)
+        print(f'{size:10d} {"greeks":>8} {greeks_time:10.4f} {size / greeks_time:12.3e}')
+
+    # One pricing object per contract, as the comparison scripts do
+    contracts = chain[:loop_size]
+    loop_time, _ = time_call(lambda: [
+        (StandardEuropeanOptions.StandardCallOption if c['is_call'] else StandardEuropeanOptions.StandardPutOption)(
+            c['initial_price'], c['strike_price'], c['interest_rate'], c['volatility'], c['time_to_maturity']
+        ).compute() for c in contracts])
+    print(f'{len(contracts):10d} {"objects":>8} {loop_time:10.4f} {len(contracts) / loop_time:12.3e}')
+
+def implied_volatility_chain(quote_counts=(1000, 100000), loop_size=200, seed=0):
+    '''
+        Throughput (quotes/second) of the vectorized implied volatility solver against a
+        scipy root finder around StandardCallOption/StandardPutOption.compute per quote,
+        with the share of converged quotes and the largest repricing error among them (the
+        volatility error itself is unbounded for quotes without time value)
+    '''
+    from scipy.optimize import brentq
+    rng = np.random.default_rng(seed)
+    print(f'{"quotes":>8} {"method":>10} {"time [s]":>10} {"quotes/s":>10} {"converged":>10} {"max error":>10}')
+    for size in quote_counts:
+        initial_price = rng.uniform(50, 150, size)
+        strike_price = initial_price * np.exp(rng.uniform(-0.5, 0.5, size))
+        interest_rate = rng.uniform(0, 0.1, size)
+        volatility = rng.uniform(0.05, 1, size)
+        time_to_maturity = rng.uniform(0.1, 5, size)
+        is_call = rng.random(size) < 0.5
+        quotes = (StandardEuropeanOptions.black_scholes_price(initial_price, strike_price, interest_rate, volatility,
+                                                              time_to_maturity, is_call),
+                  initial_price, strike_price, interest_rate, time_to_maturity, is_call)
+
+        solve_time, (implied, converged) = time_call(StandardEuropeanOptions.implied_volatility, *quotes, repeats=3)
+        repriced = StandardEuropeanOptions.black_scholes_price(initial_price, strike_price, interest_rate, implied,
+                                                               time_to_maturity, is_call)
+        error = np.max(np.abs(repriced - quotes[0])[converged])
+        print(f'{size:8d} {"vectorized":>10} {solve_time:10.4f} {size / solve_time:10.3e} '
+              f'{np.mean(converged):10.4f} {error:10.2e}')
+
+    # One root finder per quote, as calibration did before
+    def invert(price, s, k, r, t, call):
+        option_class = StandardEuropeanOptions.StandardCallOption if call else StandardEuropeanOptions.StandardPutOption
+        return brentq(lambda sigma: option_class(s, k, r, sigma, t).compute() - price, 1e-6, 10, xtol=1e-12)
+    loop_quotes = [quote[:loop_size] for quote in quotes]
+    loop_time, implied = time_call(lambda: [invert(*quote) for quote in zip(*loop_quotes)])
+    repriced = StandardEuropeanOptions.black_scholes_price(*loop_quotes[1:4], np.array(implied), *loop_quotes[4:])
+    error = np.max(np.abs(repriced - loop_quotes[0]))
+    print(f'{loop_size:8d} {"brentq":>10} {loop_time:10.4f} {loop_size / loop_time:10.3e} {1:10.4f} {error:10.2e}')
+
+
+def asian_implied_volatility(quotes=10000, direct_quotes=3, seed=0, interest_rate=0.05, time_partition_size=100,
+                             spatial_partition_size=500):
+    '''
+        Build time of an FDS Asian price table, time per quote of inverting prices through it
+        against a root finder around AsianCallOption.solve, and the table error report
+    '''
+    from scipy.optimize import brentq
+    build_time, table = time_call(AsianImpliedVolatility.AsianPriceTable.build, interest_rate,
+                                  np.linspace(0.6, 1.6, 41), np.linspace(0.05, 1.0, 20), np.linspace(0.1, 2, 10),
+                                  time_partition_size, spatial_partition_size)
+    print(f'table of {table.prices.size} prices built in {build_time:.2f} s')
+
+    rng = np.random.default_rng(seed)
+    strike_price = rng.uniform(0.8, 1.25, quotes)
+    volatility = rng.uniform(0.1, 0.9, quotes)
+    time_to_maturity = rng.uniform(0.25, 1.75, quotes)
+    price = table.price(1, strike_price, volatility, time_to_maturity)
+    table_time, (implied, converged) = time_call(table.implied_volatility, price, 1, strike_price, time_to_maturity)
+    print(f'table:  {1e6 * table_time / quotes:10.1f} us/quote, converged {np.mean(converged):.4f}')
+
+    def invert(price, strike_price, time_to_maturity):
+        return brentq(lambda sigma: AsianOptions.AsianCallOption(1, strike_price, interest_rate, sigma, time_to_maturity,
+                                                                 time_partition_size, spatial_partition_size).solve()
+                      - price, 0.05, 1.0, xtol=1e-8)
+    direct_time, _ = time_call(lambda: [invert(*quote) for quote in
+                                        zip(price[:direct_quotes], strike_price[:direct_quotes],
+                                            time_to_maturity[:direct_quotes])])
+    print(f'direct: {1e6 * direct_time / direct_quotes:10.1f} us/quote')
+    AsianImpliedVolatility.error_report(table, seed=seed)
+
+
+def asian_fast_pricing(contracts=200, quotes=100000, tolerances=(1e-2, 5e-3, 1e-3), seed=0, interest_rate=0.05,
+                       time_partition_size=250, spatial_partition_size=4000):
+    '''
+        Moment matching prices of random contracts against Richardson extrapolated FDS (error
+        and its estimate), the quoting rate of moment matching, and the share of the contracts
+        each tolerance sends to the FDS fallback with the wall time of the dispatch
+    '''
+    rng = np.random.default_rng(seed)
+    initial_price = rng.uniform(40, 60, contracts)
+    volatility = rng.choice([0.1, 0.2, 0.3, 0.5], contracts)
+    time_to_maturity = rng.choice([0.5, 1.0], contracts)
+    is_call = rng.random(contracts) < 0.5
+    settings = dict(time_partition_size=time_partition_size, spatial_partition_size=spatial_partition_size,
+                    richardson=True)
+    price, estimate = AsianApproximations.moment_matching_prices(initial_price, 50, interest_rate, volatility,
+                                                                 time_to_maturity, is_call)
+    fds_time, (reference, _) = time_call(AsianApproximations.fds_fallback,
+                                         list(zip(initial_price, np.full(contracts, 50.0),
+                                                  np.full(contracts, interest_rate), volatility, time_to_maturity,
+                                                  is_call)), **settings)
+    error = np.abs(price - reference)
+    print(f'{contracts} contracts: median |error| {np.median(error):.2e}, max {np.max(error):.2e}, '
+          f'estimate >= error for {np.mean(estimate >= error):.0%} (FDS {fds_time / contracts * 1e3:.2f} ms/contract)')
+
+    quote_time, _ = time_call(AsianApproximations.moment_matching_prices, rng.uniform(40, 60, quotes), 50,
+                              interest_rate, 0.3, 1, repeats=3)
+    print(f'moment matching: {quote_time / quotes * 1e6:.1f} us/contract')
+
+    print(f'{"tolerance":>10} {"fallback":>9} {"time [s]":>9}')
+    for tolerance in tolerances:
+        dispatch_time, result = time_call(AsianApproximations.price_asian_options, initial_price, 50, interest_rate,
+                                          volatility, time_to_maturity, is_call, tolerance=tolerance, **settings)
+        print(f'{tolerance:10.0e} {np.mean(result["method"] == "FDS"):9.0%} {dispatch_time:9.3f}')
+
+
+def sweep_result_store(volatilities=(0.1, 0.2, 0.3, 0.4, 0.5), initial_prices=(40, 45, 50, 55, 60)):
+    '''
+        Wall time of a FDS/CVMC sweep priced from scratch against rerunning it on a populated
+        ResultStore (in a temporary directory) and against extending it by one volatility
+    '''
+    import tempfile
+    methods = [('FDS', 'FDS', {'time_partition_size': 200, 'spatial_partition_size': 400}),
+               ('CVMC', 'CVMC', {'N': 100, 'n': 2000, 'seed': 0})]
+    grid = ParameterSweep.parameter_grid(initial_price=initial_prices, strike_price=[50], interest_rate=[0.05],
+                                         volatility=volatilities, time_to_maturity=[1])
+    extended = ParameterSweep.parameter_grid(initial_price=initial_prices, strike_price=[50], interest_rate=[0.05],
+                                             volatility=volatilities + (0.6,), time_to_maturity=[1])
+    with tempfile.TemporaryDirectory() as directory:
+        store = ResultStore.ResultStore(directory)
+        for name, sweep in [('cold', grid), ('warm', grid), ('extended', extended)]:
+            sweep_time, _ = time_call(ParameterSweep.run_sweep, sweep, methods, verbose=False, store=store)
+            print(f'{name:>10} {len(sweep):4d} points {sweep_time:8.3f} s')
+
+
+def _payoffs_per_path(stockpath, strike_price):
+    ''' The former per-path reduction of the CVMC pricers, kept as the baseline '''
+    arithmetic_payoff = np.array([np.max([0, np.mean(stockpath[:, i])-strike_price]) for i in range(np.shape(stockpath)[1])])
+    geometric_payoff = np.array([np.max([0, stats.mstats.gmean(stockpath[:, i])-strike_price]) for i in range(np.shape(stockpath)[1])])
+    return arithmetic_payoff, geometric_payoff
+
+
+def _payoffs_vectorized(stockpath, strike_price):
+    arithmetic_payoff = np.maximum(np.mean(stockpath, axis=0) - strike_price, 0)
+    geometric_payoff = np.maximum(np.exp(np.mean(np.log(stockpath), axis=0)) - strike_price, 0)
+    return arithmetic_payoff, geometric_payoff
+
+
+def cvmc_payoffs(path_counts=(1000, 10000), N=500, initial_price=50, strike_price=50, interest_rate=0.05,
+                 volatility=0.5, time_to_maturity=1):
+    ''' Paths/second of the payoff reduction over the whole path matrix against the per-path loop '''
+    print(f'{"paths":>8} {"method":>10} {"time [s]":>10} {"paths/s":>10}')
+    for n in path_counts:
+        stockpath = CVMCOptions.geometric_brownian_motion(initial_price, volatility, interest_rate,
+                                                          time_to_maturity, N, n)
+        for name, reduction in [('per-path', _payoffs_per_path), ('vectorized', _payoffs_vectorized)]:
+            reduction_time, _ = time_call(reduction, stockpath, strike_price)
+            print(f'{n:8d} {name:>10} {reduction_time:10.4f} {n / reduction_time:10.3e}')
+
+
+def peak_memory(function, *args, **kwargs):
+    ''' Peak traced allocation (in MB) while running function, together with its result '''
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def cvmc_streaming(path_counts=(10000, 100000), chunk_size=10000, N=252, initial_price=50, strike_price=50,
+                   interest_rate=0.05, volatility=0.5, time_to_maturity=1):
+    ''' Peak memory of the CVMC call pricer with all paths at once against streaming chunks '''
+    print(f'{"paths":>8} {"chunk":>8} {"peak [MB]":>10} {"price":>8} {"conf95":>8}')
+    for n in path_counts:
+        option = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=volatility,
+                                                 interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                                 strike_price=strike_price, N=N, n=n)
+        for chunk in (None, chunk_size):
+            peak, (price, conf95) = peak_memory(option.compute, chunk_size=chunk)
+            print(f'{n:8d} {str(chunk or n):>8} {peak:10.1f} {price:8.4f} {conf95:8.4f}')
+
+
+def cvmc_parallel(worker_counts=(1, 2, 4), n=200000, chunk_size=20000, seed=0, N=252, initial_price=50,
+                  strike_price=50, interest_rate=0.05, volatility=0.5, time_to_maturity=1):
+    ''' Wall time of the seeded CVMC call pricer for different worker counts (prices must agree bit for bit) '''
+    option = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=volatility,
+                                             interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                             strike_price=strike_price, N=N, n=n)
+    print(f'{"workers":>8} {"time [s]":>10} {"price":>20} {"conf95":>20}')
+    for workers in worker_counts:
+        parallel_time, (price, conf95) = time_call(option.compute, chunk_size=chunk_size, seed=seed, workers=workers)
+        print(f'{workers:8d} {parallel_time:10.3f} {float(price)!r:>20} {float(conf95)!r:>20}')
+
+
+def cvmc_adaptive(volatilities=(0.1, 0.3, 0.5, 0.7), tolerance=0.005, relative=True, max_paths=10**5,
+                  batch_size=1000, N=500, initial_price=50, strike_price=50, interest_rate=0.05, time_to_maturity=1):
+    ''' Paths used and wall time of the adaptive CVMC call pricer for a relative conf95 target per volatility '''
+    print(f'{"vol":>5} {"paths":>8} {"price":>8} {"conf95":>8} {"time [s]":>9}')
+    for volatility in volatilities:
+        option = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=volatility,
+                                                 interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                                 strike_price=strike_price, N=N, n=batch_size)
+        adaptive_time, (price, conf95, paths) = time_call(option.compute_adaptive, tolerance, relative,
+                                                           max_paths, batch_size, seed=0)
+        print(f'{volatility:5.2f} {paths:8d} {price:8.4f} {conf95:8.4f} {adaptive_time:9.3f}')
+
+
+def cvmc_variance_reduction(modes=(('none', 'standard'), ('unit', 'standard'), ('optimal', 'standard'),
+                                   ('optimal', 'antithetic'), ('optimal', 'sobol')),
+                            replications=20, n=4096, tolerance=0.001, N=256, initial_price=50, strike_price=50,
+                            interest_rate=0.05, volatility=0.5, time_to_maturity=1):
+    '''
+        Variance reduction factor (per path, against plain Monte Carlo) and projected time to
+        reach conf95 = tolerance for each (control variate, sampling) mode. The variance is the
+        spread of replications independent estimates, which is also valid for the quasi-random
+        mode where the i.i.d. conf95 is not
+    '''
+    option = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=volatility,
+                                             interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                             strike_price=strike_price, N=N, n=n)
+    print(f'{"control variate":>16} {"sampling":>11} {"price":>8} {"var/path":>10} {"VRF":>8} {"paths/s":>10} '
+          f'{"time to tol [s]":>16}')
+    plain_variance = None
+    for control_variate, sampling in modes:
+        start = time.perf_counter()
+        estimates = [option.compute(seed=seed, control_variate=control_variate, sampling=sampling)[0]
+                     for seed in range(replications)]
+        paths_per_second = replications * n / (time.perf_counter() - start)
+        variance = np.var(estimates, ddof=1) * n
+        plain_variance = plain_variance or variance
+        time_to_tolerance = 1.96**2 * variance / tolerance**2 / paths_per_second
+        print(f'{control_variate:>16} {sampling:>11} {np.mean(estimates):8.4f} {variance:10.3e} '
+              f'{plain_variance / variance:8.1f} {paths_per_second:10.3e} {time_to_tolerance:16.2f}')
+
+
+def cvmc_greeks(n=100000, chunk_size=20000, N=252, bump=0.01, seed=0, initial_price=50, strike_price=50,
+                interest_rate=0.05, volatility=0.3, time_to_maturity=1):
+    '''
+        Wall time and 95% confidence half-widths of delta, vega and rho from one CVMC run on
+        shared paths (pathwise and likelihood ratio) against central bump and reprice with
+        fresh paths per run, whose half-width is sqrt(2) conf95(price) / (2 bump)
+    '''
+    parameters = dict(initial_price=initial_price, volatility=volatility, interest_rate=interest_rate,
+                      time_to_maturity=time_to_maturity, strike_price=strike_price, N=N, n=n)
+
+    def bumped(name, shift, run_seed):
+        return CVMCOptions.CVMCAsianCallOption(**{**parameters, name: parameters[name] + shift}).compute(
+            chunk_size=chunk_size, seed=run_seed)
+
+    def bump_and_reprice():
+        greeks = {}
+        for k, (greek, name, size) in enumerate([('delta', 'initial_price', bump * initial_price),
+                                                 ('vega', 'volatility', bump), ('rho', 'interest_rate', bump)]):
+            (up, conf95), (down, _) = bumped(name, size, seed + 2 * k + 1), bumped(name, -size, seed + 2 * k + 2)
+            greeks[greek] = ((up - down) / (2 * size), np.sqrt(2) * conf95 / (2 * size))
+        return greeks
+
+    option = CVMCOptions.CVMCAsianCallOption(**parameters)
+    price_time, _ = time_call(option.compute, chunk_size=chunk_size, seed=seed)
+    print(f'{"method":>18} {"time [s]":>9} ' + ' '.join(f'{greek:>20}' for greek in ('delta', 'vega', 'rho')))
+    for label, function in [('bump and reprice', bump_and_reprice)] + \
+                           [(estimator, lambda estimator=estimator: option.compute_greeks(
+                               chunk_size=chunk_size, seed=seed, estimator=estimator))
+                            for estimator in CVMCOptions.GREEK_ESTIMATORS]:
+        greek_time, greeks = time_call(function)
+        print(f'{label:>18} {greek_time:9.3f} ' +
+              ' '.join(f'{greeks[greek][0]:9.4f} +- {greeks[greek][1]:7.4f}' for greek in ('delta', 'vega', 'rho')))
+    print(f'(one pricing run {price_time:.3f} s)')
+
+
+def _legacy_geometric_brownian_motion(s, sigma, r, T, N, n):
+    ''' The former path generator (ones matrix, two cumsums, transposes and a concatenation) '''
+    h = T / N
+    W = np.random.randn(n, N)
+    q = np.ones((n, N))
+    path = s * np.exp((r - sigma ** 2 / 2) * h * np.cumsum(q.T, axis=0) + sigma * np.sqrt(h) * np.cumsum(W.T, axis=0))
+    return np.concatenate((s * np.ones((1, n)), path))
+
+
+def path_generation(n=100000, N=252, initial_price=50, interest_rate=0.05, volatility=0.5, time_to_maturity=1):
+    ''' Wall time and peak memory of the former path generator against the in-place one and the running averages '''
+    args = (initial_price, volatility, interest_rate, time_to_maturity, N, n)
+    rng = np.random.default_rng(0)
+    print(f'{"generator":>28} {"time [s]":>9} {"peak [MB]":>10}')
+    for name, function, kwargs in [('legacy paths', _legacy_geometric_brownian_motion, {}),
+                                   ('paths float64', CVMCOptions.geometric_brownian_motion, dict(rng=rng)),
+                                   ('paths float32', CVMCOptions.geometric_brownian_motion,
+                                    dict(rng=rng, dtype=np.float32)),
+                                   ('averages float64', CVMCOptions.path_averages, dict(rng=rng)),
+                                   ('averages float32', CVMCOptions.path_averages, dict(rng=rng, dtype=np.float32))]:
+        generation_time, _ = time_call(function, *args, **kwargs)
+        peak, _ = peak_memory(function, *args, **kwargs)
+        print(f'{name:>28} {generation_time:9.3f} {peak:10.1f}')
+
+
+def cvmc_book(trades=50, n=20000, chunk_size=10000, seed=0, initial_price=50, interest_rate=0.05, volatility=0.3):
+    '''
+        Wall time of the nightly reval of a book of seasoned and fresh Asian trades on one
+        underlying with monthly fixings, one simulation per trade against one shared path set
+    '''
+    rng = np.random.default_rng(seed)
+    book = []
+    for k in range(trades):
+        maturity = rng.choice([0.5, 1.0, 2.0])
+        fixings = np.arange(1, int(12 * maturity) + 1) / 12
+        elapsed = rng.integers(0, len(fixings) // 2 + 1)
+        option_class = CVMCOptions.CVMCAsianCallOption if k % 2 == 0 else CVMCOptions.CVMCAsianPutOption
+        book.append(option_class(initial_price, volatility, interest_rate, maturity - elapsed / 12,
+                                 strike_price=rng.uniform(40, 60), N=None, n=n,
+                                 fixing_times=fixings[elapsed:] - elapsed / 12,
+                                 fixed_average=initial_price if elapsed else None, fixed_count=elapsed))
+    per_trade_time, per_trade = time_call(lambda: [option.compute(chunk_size=chunk_size, seed=seed) for option in book])
+    book_time, shared = time_call(CVMCOptions.price_book, book, chunk_size=chunk_size, seed=seed)
+    difference = max(abs(a[0] - b[0]) for a, b in zip(per_trade, shared))
+    conf95 = max(b[1] for b in shared)
+    print(f'{trades} trades: per trade {per_trade_time:.3f} s, shared paths {book_time:.3f} s '
+          f'(speedup {per_trade_time / book_time:.1f}x, max |difference| {difference:.4f}, max conf95 {conf95:.4f})')
+
+
+def pricing_service(requests=200, volatilities=(0.1, 0.2, 0.3, 0.4, 0.5), initial_prices=(45, 50, 55), seed=0,
+                    interest_rate=0.05, time_to_maturity=1, time_partition_size=100, spatial_partition_size=200):
+    '''
+        Wall time, throughput and latency of a burst of concurrent FDS quotes on a few
+        underlyings served one solve per request (max_batch=1) against coalesced into batched
+        solves, and the largest price difference between the two
+    '''
+    import PricingService
+    rng = np.random.default_rng(seed)
+    quotes = [dict(pricer='FDS', initial_price=rng.choice(initial_prices), strike_price=50,
+                   interest_rate=interest_rate, volatility=rng.choice(volatilities), time_to_maturity=time_to_maturity,
+                   option_type=rng.choice(['call', 'put']), time_partition_size=time_partition_size,
+                   spatial_partition_size=spatial_partition_size) for _ in range(requests)]
+    print(f'{"service":>12} {"time [s]":>9} {"batches":>8} {"quotes/s":>9} {"p50 [ms]":>9} {"p95 [ms]":>9}')
+    prices = {}
+    for label, max_batch in [('per request', 1), ('coalesced', 1024)]:
+        wall_time, (results, counters) = time_call(PricingService.serve, quotes, max_batch=max_batch)
+        prices[label] = np.array([result['price'] for result in results])
+        print(f'{label:>12} {wall_time:9.3f} {counters["batches"]:8d} {counters["throughput"]:9.1f} '
+              f'{1e3 * counters["latency p50"]:9.1f} {1e3 * counters["latency p95"]:9.1f}')
+    print(f'max |difference| {np.max(np.abs(prices["per request"] - prices["coalesced"])):.2e}')
+
+def import_times(modules=('StandardEuropeanOptions', 'AsianOptions', 'CVMCOptions', 'ParameterSweep',
+                          'CompareMethods', 'CompareOptions'), repeats=3):
+    '''
+        Startup cost of importing each module in a fresh interpreter (best of repeats, less the
+        interpreter startup itself) and which heavy libraries the import drags in
+    '''
+    import subprocess
+    import sys
+
+    def startup(code):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+            best = min(best, time.perf_counter() - start)
+        return best, output
+
+    interpreter, _ = startup('pass')
+    print(f'{"module":>24} {"import [s]":>11}  loaded')
+    for module in modules:
+        import_time, loaded = startup(f'import sys, {module}; print(" ".join(library for library in '
+                                      f'("scipy", "matplotlib", "seaborn") if library in sys.modules))')
+        print(f'{module:>24} {import_time - interpreter:11.3f}  {loaded.strip() or "numpy only"}')
+
+
+# Contract priced by every case of the benchmark suite
+SUITE_CONTRACT = dict(initial_price=50, strike_price=50, interest_rate=0.05, volatility=0.3, time_to_maturity=1)
+
+
+def asian_reference_price(time_partition_size=1000, spatial_partition_size=2000, **contract):
+    ''' High resolution FDS price of the Asian call, Richardson extrapolated from half the grid '''
+    contract = {**SUITE_CONTRACT, **contract}
+    option = AsianOptions.AsianCallOption(time_partition_size=time_partition_size,
+                                          spatial_partition_size=spatial_partition_size, **contract)
+    return float(option.solve(richardson=True))
+
+
+def asian_fixings_reference_price(fixings, continuous_reference=None, **contract):
+    '''
+        Reference price of the Asian call on the fixings + 1 equally weighted fixings of the
+        CVMC pricers: the FDS reference of the continuous average (continuous_reference if
+        given) corrected by the moment matching difference between the discrete and the
+        continuous average. The moment matching error is nearly the same for both, so it
+        cancels in the correction
+    '''
+    contract = {**SUITE_CONTRACT, **contract}
+    arguments = [contract[name] for name in ('initial_price', 'strike_price', 'interest_rate', 'volatility',
+                                             'time_to_maturity')]
+    discrete, _ = AsianApproximations.moment_matching_prices(*arguments, fixings=fixings)
+    continuous, _ = AsianApproximations.moment_matching_prices(*arguments)
+    if continuous_reference is None:
+        continuous_reference = asian_reference_price(**contract)
+    return continuous_reference + float(discrete - continuous)
+
+
+def benchmark_suite(fds_grids=((50, 100), (100, 500), (250, 500), (500, 1000)),
+                    cvmc_sizes=((100, 1000), (252, 10000), (500, 10000)), seed=0):
+    '''
+        Cases of the benchmark suite as (name, function, reference) with function returning
+        a price and reference the price it is measured against (None for no accuracy)
+    '''
+    contract = SUITE_CONTRACT
+    asian_reference = asian_reference_price()
+    european_reference = float(StandardEuropeanOptions.black_scholes_price(**contract))
+    cases = [('StandardCallOption.compute',
+              lambda: StandardEuropeanOptions.StandardCallOption(**contract).compute(), european_reference)]
+    for time_partition_size, spatial_partition_size in fds_grids:
+        cases.append((f'AsianCallOption.solve N={time_partition_size} M={spatial_partition_size}',
+                      lambda N=time_partition_size, M=spatial_partition_size: AsianOptions.AsianCallOption(
+                          time_partition_size=N, spatial_partition_size=M, **contract).solve(),
+                      asian_reference))
+    # The CVMC pricers average N + 1 fixings, so they are measured against the reference of the same fixings
+    for N, n in cvmc_sizes:
+        cases.append((f'CVMCAsianCallOption.compute N={N} n={n}',
+                      lambda N=N, n=n: CVMCOptions.CVMCAsianCallOption(N=N, n=n, **contract).compute(seed=seed)[0],
+                      asian_fixings_reference_price(N, asian_reference, **contract)))
+    return cases
+
+
+def run_suite(cases, repeats=3) -> list:
+    ''' Best wall time over repeats, peak traced memory and absolute error of every case '''
+    records = []
+    for name, function, reference in cases:
+        wall_time, price = time_call(function, repeats=repeats)
+        peak, _ = peak_memory(function)
+        records.append({'name': name, 'wall time': wall_time, 'peak memory': peak, 'price': float(price),
+                        'error': None if reference is None else abs(float(price) - reference)})
+    return records
+
+
+def save_results(records, path):
+    ''' Write the records as JSON together with the machine and library versions they were measured on '''
+    import json
+    import platform
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'machine': platform.platform(),
+              'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'records': records}
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def find_regressions(records, baseline_path, time_tolerance=0.25, memory_tolerance=0.25, error_tolerance=1e-8,
+                     min_time=0.005) -> list:
+    '''
+        Compare the records against a stored baseline report, returning (name, metric, baseline,
+        current) for every case whose wall time or peak memory grew by more than the relative
+        tolerance (and the wall time by more than min_time seconds, below which timings are
+        noise), or whose error grew by more than error_tolerance
+    '''
+    import json
+    with open(baseline_path) as file:
+        baseline = {record['name']: record for record in json.load(file)['records']}
+    regressions = []
+    for record in records:
+        reference = baseline.get(record['name'])
+        if reference is None:
+            continue
+        if record['wall time'] > max((1 + time_tolerance) * reference['wall time'], reference['wall time'] + min_time):
+            regressions.append((record['name'], 'wall time', reference['wall time'], record['wall time']))
+        if record['peak memory'] > (1 + memory_tolerance) * reference['peak memory']:
+            regressions.append((record['name'], 'peak memory', reference['peak memory'], record['peak memory']))
+        if record['error'] is not None and reference['error'] is not None and \
+                record['error'] > reference['error'] + error_tolerance:
+            regressions.append((record['name'], 'error', reference['error'], record['error']))
+    return regressions
+
+
+def print_records(records):
+    print(f'{"case":>48} {"time [s]":>10} {"peak [MB]":>10} {"price":>10} {"error":>10}')
+    for record in records:
+        error = '' if record['error'] is None else f'{record["error"]:10.2e}'
+        print(f'{record["name"]:>48} {record["wall time"]:10.4f} {record["peak memory"]:10.2f} '
+              f'{record["price"]:10.5f} {error:>10}')
+
+
+STUDIES = [fds_solver, fds_operator_cache, fds_volatility_batch, fds_nonuniform, fds_convergence, black_scholes_chain,
+           implied_volatility_chain, asian_implied_volatility, asian_fast_pricing, sweep_result_store, cvmc_payoffs,
+           cvmc_streaming, cvmc_parallel, cvmc_adaptive, cvmc_variance_reduction, cvmc_greeks, path_generation,
+           cvmc_book, pricing_service, import_times]
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import sys
+    parser = argparse.ArgumentParser(description='Benchmark suite of the option pricers')
+    parser.add_argument('--output', default=os.path.join('Results', 'benchmarks.json'))
+    parser.add_argument('--baseline', default=os.path.join('Results', 'benchmark_baseline.json'))
+    parser.add_argument('--update-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--studies', action='store_true', help='also run the detailed benchmark studies')
+    arguments = parser.parse_args()
+
+    records = run_suite(benchmark_suite(), arguments.repeats)
+    print_records(records)
+    save_results(records, arguments.output)
+    regressions = []
+    if arguments.update_baseline:
+        save_results(records, arguments.baseline)
+    elif os.path.exists(arguments.baseline):
+        regressions = find_regressions(records, arguments.baseline)
+        for name, metric, baseline, current in regressions:
+            print(f'REGRESSION {name}: {metric} {baseline:.4g} -> {current:.4g}')
+        if not regressions:
+            print(f'No regressions against {arguments.baseline}')
+
+    if arguments.studies:
+        for study in STUDIES:
+            study()
+    # Non-zero exit status on regressions, so the suite can gate a build
+    sys.exit(1 if regressions else 0)
@@ -1,66 +1,313 @@
 import numpy as np
-import scipy.stats as stats
-def geometric_brownian_motion(s, sigma, r, T, N, n):
+from Instrumentation import NO_STATS, SolverStats
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+SAMPLINGS = ('standard', 'antithetic', 'sobol')
+CONTROL_VARIATES = ('none', 'unit', 'optimal')
+GREEK_ESTIMATORS = ('pathwise', 'likelihood ratio')
+GREEKS = ('price', 'delta', 'vega', 'rho')
+
+
+def brownian_bridge_order(N):
+    ''' Construction order (point, left, right) of a Brownian bridge on the steps 1..N: the
+        end point first (from 0) and then recursive midpoints, with right None for the end point
+    '''
+    order = [(N, 0, None)]
+    intervals = [(0, N)]
+    while intervals:
+        left, right = intervals.pop(0)
+        if right - left > 1:
+            middle = (left + right) // 2
+            order.append((middle, left, right))
+            intervals += [(left, middle), (middle, right)]
+    return order
+
+
+def brownian_bridge_increments(Z, times=None):
+    ''' Standard normal increments (one row per time step) of the Brownian paths built by a
+        Brownian bridge from the rows of Z in order of importance (first row sets the end point).
+        With times (the increasing positive step end times) the bridge runs on that grid and
+        the increments are normalised by the square root of their step, else on 1..N
+    '''
+    N, n = np.shape(Z)
+    t = np.arange(N+1, dtype=np.float64) if times is None else np.concatenate(([0.0], times))
+    W = np.zeros((N+1, n))
+    for k, (point, left, right) in enumerate(brownian_bridge_order(N)):
+        if right is None:
+            W[point] = np.sqrt(t[point]) * Z[k]
+        else:
+            W[point] = ((t[right] - t[point]) * W[left] + (t[point] - t[left]) * W[right]) / (t[right] - t[left]) + \
+                       np.sqrt((t[point] - t[left]) * (t[right] - t[point]) / (t[right] - t[left])) * Z[k]
+    return np.diff(W, axis=0) / np.sqrt(np.diff(t))[:, None]
+
+
+def sample_count(n, sampling='standard'):
+    '''
+        Number of paths generated for n requested, antithetic sampling rounds up to whole pairs
+        and Sobol sampling to the next power of two, the point counts that keep the balance
+        properties of the Sobol sequence
+    '''
+    if sampling == 'antithetic':
+        return 2 * ((n + 1) // 2)
+    if sampling == 'sobol':
+        return 1 << max(int(n) - 1, 0).bit_length()
+    return n
+
+
+def standard_normals(n, N, rng=None, sampling='standard', dtype=np.float64, out=None, times=None):
+    ''' N x n standard normal increments, one row per time step and one column per path,
+        written into out (a C-contiguous N x sample_count(n, sampling) array) if given.
+        'standard': independent draws from rng (or the global np.random state if None).
+        'antithetic': ceil(n/2) independent columns followed by their negations.
+        'sobol': scrambled Sobol points through the inverse normal cdf, assigned to the
+        increments by a Brownian bridge so the leading dimensions drive the coarse path shape
+        (on the step end times if given, for non-uniform steps). n is rounded up to a power of
+        two (see sample_count), so chunk and batch sizes that are powers of two waste nothing
+    '''
+    if out is None:
+        out = np.empty((N, sample_count(n, sampling)), dtype)
+    if sampling == 'standard':
+        if rng is None:
+            out[...] = np.random.randn(N, n)
+        else:
+            rng.standard_normal(dtype=out.dtype, out=out)
+    elif sampling == 'antithetic':
+        pairs = (n + 1) // 2
+        Z = standard_normals(pairs, N, rng, 'standard', out.dtype)
+        out[:, :pairs] = Z
+        np.negative(Z, out=out[:, pairs:])
+    elif sampling == 'sobol':
+        from scipy.special import ndtri
+        from scipy.stats import qmc
+        uniforms = qmc.Sobol(d=N, scramble=True, seed=rng).random_base2(sample_count(n, sampling).bit_length() - 1)
+        Z = ndtri(np.clip(uniforms, np.finfo(float).tiny, 1 - np.finfo(float).eps))
+        out[...] = brownian_bridge_increments(Z.T, times)
+    else:
+        raise ValueError(f'Unknown sampling "{sampling}", expected one of {SAMPLINGS}')
+    return out
+
+
+def log_returns(sigma, r, times, n, rng=None, sampling='standard', dtype=np.float64, out=None):
+    ''' Cumulative log returns log(S(t_j)/s) at the increasing positive times t_j, built in
+        place in one len(times) x n buffer
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    steps = np.diff(times, prepend=0)[:, None]
+    X = standard_normals(n, len(times), rng, sampling, dtype, out, times)
+    X *= sigma * np.sqrt(steps)
+    X += (r - sigma ** 2 / 2) * steps
+    return np.cumsum(X, axis=0, out=X)
+
+
+def uniform_times(T, N):
+    ''' The N+1 points 0, T/N, ..., T of the uniform partition of [0,T] '''
+    return np.arange(N+1) * (T / N)
+
+
+def geometric_brownian_motion(s, sigma, r, T, N, n, rng=None, sampling='standard', dtype=np.float64):
     ''' Path of the stock price
         Have uniform partition of size N for the time interval [0,T]
-        and thus generate N paths of the geometric Brownian motion
+        and thus generate n paths of the geometric Brownian motion, one column per path
+        (N+1 x n including s at t = 0). The paths are built in log space in a single
+        preallocated buffer in dtype (float64 or float32).
+        Draws from rng (a numpy Generator) if given, else from the global np.random state,
+        with the sampling of standard_normals (antithetic rounds n up to an even count)
     '''
-    h = T / N
-   # print(f'h: {h}')
-    W = np.random.randn(n, N)
-   # print(f'W: {W}')
-    q = np.ones((n, N))
-   # print(f'q: {q}')
-   # asd
-    path = s * np.exp((r - sigma ** 2 / 2) * h * np.cumsum(q.T, axis=0) + sigma * np.sqrt(h) * np.cumsum(W.T, axis=0))
+    path = np.empty((N+1, sample_count(n, sampling)), dtype)
+    path[0] = 0
+    log_returns(sigma, r, uniform_times(T, N)[1:], n, rng, sampling, dtype, out=path[1:])
+    np.exp(path, out=path)
+    path *= s
+    return path
 
-    path = np.concatenate((s * np.ones((1, n)), path))
 
-    return path
+def fixing_averages(s, sigma, r, times, n, rng=None, sampling='standard', dtype=np.float64, buffer=None):
+    '''
+        Arithmetic and geometric averages of the stock price over the fixing times of each of
+        n paths, without keeping the paths: the running log sum is taken before and the
+        arithmetic sum after exponentiating the one buffer of log returns in place. Fixings
+        at t = 0 are s itself and are not simulated. buffer may be a preallocated flat array
+        of at least len(times) * sample_count(n, sampling) elements in dtype, reused across chunks
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    simulated = times[times > 0]
+    size = len(simulated) * sample_count(n, sampling)
+    buffer = np.empty(size, dtype) if buffer is None else buffer
+    X = log_returns(sigma, r, simulated, n, rng, sampling, dtype,
+                    out=buffer[:size].reshape(len(simulated), sample_count(n, sampling)))
+    count = max(len(times), 1)
+    log_sum = np.sum(X, axis=0, dtype=np.float64)
+    np.exp(X, out=X)
+    arithmetic_average = s * (len(times) - len(simulated) + np.sum(X, axis=0, dtype=np.float64)) / count
+    geometric_average = s * np.exp(log_sum / count)
+    return arithmetic_average, geometric_average
+
 
-class CVMCAsianCallOption(object):
+def fixing_sensitivities(s, sigma, r, times, n, rng=None, sampling='standard', dtype=np.float64,
+                         estimator='pathwise'):
     '''
-        Compute risk-neutral price of Asian call with control variate MC with geometric price as CV
+        Arithmetic and geometric averages over the fixing times of n paths as in fixing_averages
+        (drawing the same paths for the same rng), together with the per path terms of their
+        Greeks. For the 'pathwise' estimator these are the derivatives of the averages in sigma
+        and r, from
+            dS(t)/dsigma = S(t) (log(S(t)/s) - (r + sigma^2/2) t) / sigma,   dS(t)/dr = t S(t)
+        (those in s are the averages over s), for 'likelihood ratio' the scores of the path
+        density in s, sigma and r, from the standardized increments Z_j over the steps dt_j,
+            Z_1 / (s sigma sqrt(dt_1)),   sum_j (Z_j^2 - 1) / sigma - Z_j sqrt(dt_j),   sum_j Z_j sqrt(dt_j) / sigma
+        Unlike fixing_averages the log returns are kept next to the prices, so a chunk takes
+        about twice the memory
     '''
-    def __init__(self, initial_price, volatility, interest_rate, time_to_maturity, strike_price, N, n):
-        super(CVMCAsianCallOption, self).__init__()
-        self.initial_price = initial_price
-        self.volatility = volatility
-        self.interest_rate = interest_rate
-        self.time_to_maturity = time_to_maturity
-        self.strike_price = strike_price
-        self.N = N
-        self.n = n
+    times = np.asarray(times, dtype=np.float64)
+    simulated = times[times > 0]
+    count = max(len(times), 1)
+    X = log_returns(sigma, r, simulated, n, rng, sampling, dtype).astype(np.float64, copy=False)
+    prices = np.exp(X)
+    log_sum = np.sum(X, axis=0)
+    arithmetic_average = s * (len(times) - len(simulated) + np.sum(prices, axis=0)) / count
+    geometric_average = s * np.exp(log_sum / count)
+
+    if estimator == 'pathwise':
+        drift = (r + sigma**2 / 2) * simulated
+        X -= drift[:, None]
+        terms = {'arithmetic vega': s * np.einsum('ij,ij->j', prices, X) / (sigma * count),
+                 'arithmetic rho': s * np.dot(simulated, prices) / count,
+                 'geometric vega': geometric_average * (log_sum - np.sum(drift)) / (sigma * count),
+                 'geometric rho': geometric_average * np.sum(simulated) / count}
+    else:
+        steps = np.diff(simulated, prepend=0)
+        Z = np.diff(X, axis=0, prepend=0)
+        Z -= ((r - sigma**2 / 2) * steps)[:, None]
+        Z /= (sigma * np.sqrt(steps))[:, None]
+        terms = {'delta score': Z[0] / (s * sigma * np.sqrt(steps[0])) if len(simulated) else np.zeros(X.shape[1]),
+                 'vega score': (np.einsum('ij,ij->j', Z, Z) - len(simulated)) / sigma - np.dot(np.sqrt(steps), Z),
+                 'rho score': np.dot(np.sqrt(steps), Z) / sigma}
+    return arithmetic_average, geometric_average, terms
+
+
+def path_averages(s, sigma, r, T, N, n, rng=None, sampling='standard', dtype=np.float64, buffer=None):
+    ''' Arithmetic and geometric averages over the N+1 points of each of the n paths of
+        geometric_brownian_motion (see fixing_averages)
+    '''
+    return fixing_averages(s, sigma, r, uniform_times(T, N), n, rng, sampling, dtype, buffer)
+
+
+def lognormal_option_price(log_mean, log_variance, strike_price, discount, is_call=True):
+    '''
+        Discounted call (or put) price on a lognormal underlying G with log G ~ N(log_mean, log_variance),
+        as for the geometric average, element-wise over arrays. A zero variance (all fixings
+        known) gives the intrinsic value
+    '''
+    from scipy.special import ndtr
+    log_mean, log_variance, strike_price = (np.asarray(argument, dtype=np.float64) for argument in
+                                            (log_mean, log_variance, strike_price))
+    forward = np.exp(log_mean + log_variance / 2)
+    sign = np.where(is_call, 1.0, -1.0)
+    deviation = np.sqrt(np.maximum(log_variance, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d2 = (log_mean - np.log(strike_price)) / deviation
+    d1 = d2 + deviation
+    price = np.where(log_variance > 0, sign * (forward * ndtr(sign * d1) - strike_price * ndtr(sign * d2)),
+                     np.maximum(sign * (forward - strike_price), 0))
+    return (discount * price)[()]
+
+
+def lognormal_price_derivatives(log_mean, log_variance, strike_price, discount, is_call=True):
+    '''
+        Derivatives of lognormal_option_price in log_mean and in log_variance (log_mean held
+        fixed), with F the forward and sign +1 for calls and -1 for puts
+            discount sign F N(sign d1),   discount (sign F N(sign d1) / 2 + F phi(d1) / (2 sqrt(log_variance)))
+    '''
+    from scipy.special import ndtr
+    forward = np.exp(log_mean + log_variance / 2)
+    sign = 1.0 if is_call else -1.0
+    if log_variance <= 0:
+        return discount * sign * forward * (sign * (forward - strike_price) > 0), 0.0
+    deviation = np.sqrt(log_variance)
+    d1 = (log_mean - np.log(strike_price)) / deviation + deviation
+    in_the_money = sign * forward * ndtr(sign * d1)
+    return discount * in_the_money, \
+        discount * (in_the_money / 2 + forward * np.exp(-d1**2 / 2) / (np.sqrt(2 * np.pi) * 2 * deviation))
 
-    def compute(self):
-        q = 0.5 * (self.interest_rate - (self.volatility**2 / 6))
-        d1 = (np.log(self.initial_price / self.strike_price) + (q * self.time_to_maturity)) /\
-             (self.volatility * np.sqrt(self.time_to_maturity / 3))
-        d2 = d1 - self.volatility * np.sqrt(self.time_to_maturity / 3)
 
+def control_variate_estimate(statistics, control_mean, control_variate='optimal'):
+    '''
+        Control variate estimate mean(Y) - beta (mean(X) - control_mean) and its 95% confidence
+        half-width from the statistics of the (Y, X) samples, with beta = 0 ('none'), 1 ('unit')
+        or the variance minimizing Cov(Y, X) / Var(X) estimated from the samples ('optimal')
+    '''
+    if control_variate not in CONTROL_VARIATES:
+        raise ValueError(f'Unknown control variate "{control_variate}", expected one of {CONTROL_VARIATES}')
+    covariance = statistics.covariance()
+    beta = {'none': 0.0, 'unit': 1.0}.get(control_variate)
+    if beta is None:
+        beta = covariance[0, 1] / covariance[1, 1] if covariance[1, 1] > 0 else 1.0
+    estimate = statistics.mean[0] - beta * (statistics.mean[1] - control_mean)
+    variance = covariance[0, 0] - 2 * beta * covariance[0, 1] + beta**2 * covariance[1, 1]
+    return estimate, 1.96 * np.sqrt(max(variance, 0)) / np.sqrt(statistics.count)
 
-        geometric_call_price = np.exp(-self.interest_rate * self.time_to_maturity) * (np.exp(q * self.time_to_maturity) * \
-            self.initial_price * stats.norm.cdf(d1) - self.strike_price * stats.norm.cdf(d2))
 
-        stockpath = geometric_brownian_motion(self.initial_price, self.volatility, self.interest_rate,
-                                              self.time_to_maturity, self.N, self.n)
+def chunk_sizes(n, chunk_size):
+    return [min(chunk_size, n - start) for start in range(0, n, chunk_size)]
 
 
-        arithmetic_payoff = np.array([np.max([0, np.mean(stockpath[:, i])-self.strike_price]) for i in range(np.shape(stockpath)[1])])
-        geometric_payoff = np.array([np.max([0, stats.mstats.gmean(stockpath[:, i])-self.strike_price]) for i in range(np.shape(stockpath)[1])])
+def chunk_seeds(seed, chunks):
+    ''' Independent seed sequences, one per chunk, spawned from np.random.SeedSequence(seed) '''
+    return np.random.SeedSequence(seed).spawn(chunks)
 
-        price = np.exp(-self.interest_rate * self.time_to_maturity) * np.mean(arithmetic_payoff - geometric_payoff) + geometric_call_price
-        conf95 = 1.96 * np.std(arithmetic_payoff - geometric_payoff) / np.sqrt(self.n)
-        return price, conf95
 
+def chunk_generators(n, chunk_size, seed=None):
+    ''' (size, rng) per chunk, where rng is None (global state) unless a seed is given '''
+    sizes = chunk_sizes(n, chunk_size)
+    seeds = chunk_seeds(seed, len(sizes)) if seed is not None else [None] * len(sizes)
+    for size, seed_sequence in zip(sizes, seeds):
+        yield size, np.random.default_rng(seed_sequence) if seed_sequence is not None else None
 
 
-class CVMCAsianPutOption(object):
+class ControlVariateStatistics(object):
     '''
-        Compute risk-neutral price of Asian put with control variate MC with geometric price as CV
+        Running sample mean and co-moment matrix of the (arithmetic, geometric) payoff pairs,
+        updated chunk by chunk with the pairwise merge of Chan et al. so the result does not
+        depend on holding all payoffs at once
+    '''
+    def __init__(self):
+        super(ControlVariateStatistics, self).__init__()
+        self.count = 0
+        self.mean = np.zeros(2)
+        self.comoment = np.zeros((2, 2))
+
+    def update(self, arithmetic_payoff, geometric_payoff):
+        payoffs = np.stack((arithmetic_payoff, geometric_payoff)).astype(np.float64, copy=False)
+        chunk = ControlVariateStatistics()
+        chunk.count = payoffs.shape[1]
+        chunk.mean = np.mean(payoffs, axis=1)
+        centered = payoffs - chunk.mean[:, None]
+        chunk.comoment = np.matmul(centered, centered.T)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.count * other.count / count)
+        self.mean = self.mean + delta * (other.count / count)
+        self.count = count
+        return self
+
+    def covariance(self):
+        return self.comoment / self.count
+
+
+class CVMCAsianOption(object):
+    '''
+        Shared control variate Monte Carlo engine for the Asian options, with the geometric
+        average option over the same fixings (known in closed form) as control variate
     '''
-    def __init__(self, initial_price, volatility, interest_rate, time_to_maturity, strike_price, N, n):
-        super(CVMCAsianPutOption, self).__init__()
+    option_type = None
+
+    def __init__(self, initial_price, volatility, interest_rate, time_to_maturity, strike_price, N, n,
+                 dtype=np.float64, fixing_times=None, fixed_average=None, fixed_count=0):
+        super(CVMCAsianOption, self).__init__()
         self.initial_price = initial_price
         self.volatility = volatility
         self.interest_rate = interest_rate
@@ -68,27 +315,366 @@ class CVMCAsianPutOption(object):
         self.strike_price = strike_price
         self.N = N
         self.n = n
+        # Precision of the simulated paths (the payoff statistics are always float64)
+        self.dtype = dtype
+
+        # Fixing schedule of the average in years from today, None for the uniform partition of
+        # size N of [0,T]. A seasoned trade has fixed_count fixings already taken at an
+        # (arithmetic) average of fixed_average, which enter the average with the remaining ones
+        if fixing_times is not None:
+            fixing_times = np.sort(np.asarray(fixing_times, dtype=np.float64))
+            if len(fixing_times) == 0 and fixed_count == 0:
+                raise ValueError('Expected at least one fixing')
+            if len(fixing_times) and (fixing_times[0] < 0 or fixing_times[-1] > time_to_maturity):
+                raise ValueError(f'Fixing times must lie in [0, {time_to_maturity}]')
+        if fixed_count and fixed_average is None:
+            raise ValueError('Expected the fixed_average of the fixed_count fixings already taken')
+        self.fixing_times = fixing_times
+        self.fixed_average = fixed_average
+        self.fixed_count = fixed_count
+
+    def fixings(self):
+        ''' Times of the remaining fixings '''
+        if self.fixing_times is None:
+            return uniform_times(self.time_to_maturity, self.N)
+        return self.fixing_times
+
+    def discount(self):
+        return np.exp(-self.interest_rate * self.time_to_maturity)
+
+    def geometric_moments(self):
+        '''
+            Mean and variance of the log of the geometric average over all M = c + m fixings,
+            the c fixed ones entering through log(fixed_average). For the remaining t_1 <= ... <= t_m
+                mean = (c log(fixed_average) + m log(s) + (r - sigma^2/2) sum_j t_j) / M
+                variance = sigma^2 sum_jk min(t_j, t_k) / M^2
+        '''
+        times = self.fixings()
+        remaining = len(times)
+        total = self.fixed_count + remaining
+        log_mean = remaining * np.log(self.initial_price) + (self.interest_rate - self.volatility**2 / 2) * np.sum(times)
+        if self.fixed_count:
+            log_mean += self.fixed_count * np.log(self.fixed_average)
+        # In the sorted times t_j (j from 0) is the minimum of 2(m-j)-1 of the ordered pairs
+        pairs = 2 * (remaining - np.arange(remaining)) - 1
+        log_variance = self.volatility**2 * np.dot(pairs, times) / total**2
+        return log_mean / total, log_variance
+
+    def geometric_price(self):
+        ''' Closed form price of the geometric average option over the same fixings '''
+        log_mean, log_variance = self.geometric_moments()
+        return lognormal_option_price(log_mean, log_variance, self.strike_price, self.discount(),
+                                      is_call=self.option_type == 'call')
+
+    def geometric_greeks(self) -> dict:
+        '''
+            Closed form price, delta, vega and rho of the geometric average option, by the chain
+            rule through the log mean and variance of geometric_moments and the discount
+        '''
+        times = self.fixings()
+        total = self.fixed_count + len(times)
+        log_mean, log_variance = self.geometric_moments()
+        price = self.geometric_price()
+        by_mean, by_variance = lognormal_price_derivatives(log_mean, log_variance, self.strike_price, self.discount(),
+                                                           is_call=self.option_type == 'call')
+        return {'price': price,
+                'delta': by_mean * len(times) / (total * self.initial_price),
+                'vega': -by_mean * self.volatility * np.sum(times) / total + by_variance * 2 * log_variance /
+                        self.volatility,
+                'rho': by_mean * np.sum(times) / total - self.time_to_maturity * price}
+
+    def payoff(self, average):
+        raise NotImplementedError
+
+    def payoff_slope(self, average):
+        ''' Derivative of the payoff in the average '''
+        raise NotImplementedError
+
+    def seasoned_averages(self, arithmetic_average, geometric_average):
+        ''' Averages over all fixings from those over the remaining ones '''
+        if not self.fixed_count:
+            return arithmetic_average, geometric_average
+        remaining = len(self.fixings())
+        total = self.fixed_count + remaining
+        arithmetic_average = (self.fixed_count * self.fixed_average + remaining * arithmetic_average) / total
+        geometric_average = np.exp((self.fixed_count * np.log(self.fixed_average) +
+                                    remaining * np.log(geometric_average)) / total)
+        return arithmetic_average, geometric_average
+
+    def payoff_statistics(self, arithmetic_average, geometric_average, sampling='standard', stats=None):
+        ''' Payoff statistics from the averages over the remaining fixings of simulated paths.
+            Antithetic pairs are averaged first, so every sample is one pair and the
+            statistics reflect the variance of the pair average
+        '''
+        stats = stats or NO_STATS
+        with stats.phase('payoff'):
+            arithmetic_average, geometric_average = self.seasoned_averages(arithmetic_average, geometric_average)
+            arithmetic_payoff = self.payoff(arithmetic_average)
+            geometric_payoff = self.payoff(geometric_average)
+            if sampling == 'antithetic':
+                pairs = len(arithmetic_payoff) // 2
+                arithmetic_payoff = 0.5 * (arithmetic_payoff[:pairs] + arithmetic_payoff[pairs:])
+                geometric_payoff = 0.5 * (geometric_payoff[:pairs] + geometric_payoff[pairs:])
+        with stats.phase('statistics'):
+            return ControlVariateStatistics().update(arithmetic_payoff, geometric_payoff)
 
-    def compute(self):
-        q = 0.5 * (self.interest_rate - (self.volatility ** 2 / 6))
-        d1 = (np.log(self.initial_price / self.strike_price) + (q * self.time_to_maturity)) / \
-             (self.volatility * np.sqrt(self.time_to_maturity / 3))
-        d2 = d1 - self.volatility * np.sqrt(self.time_to_maturity / 3)
+    def sample_statistics(self, n, rng=None, sampling='standard', buffer=None, stats=None):
+        ''' Payoff statistics of n simulated paths, from their running averages only (see fixing_averages) '''
+        stats = stats or NO_STATS
+        with stats.phase('path generation'):
+            averages = fixing_averages(self.initial_price, self.volatility, self.interest_rate, self.fixings(),
+                                       n, rng, sampling, self.dtype, buffer)
+        stats.iterate('paths', sample_count(n, sampling))
+        return self.payoff_statistics(*averages, sampling, stats)
 
-        geometric_put_price = np.exp(-self.interest_rate * self.time_to_maturity) * (self.strike_price *
-                    stats.norm.cdf(-d2) - np.exp(q * self.time_to_maturity) * self.initial_price * stats.norm.cdf(-d1))
+    def estimate(self, statistics, control_variate='optimal'):
+        '''
+            Control variate price and 95% confidence half-width from the payoff statistics,
+            price = e^{-rT} (mean(arithmetic) - beta mean(geometric)) + beta geometric_price,
+            with beta as in control_variate_estimate and the half-width discounted like the price
+        '''
+        mean, conf95 = control_variate_estimate(statistics, self.geometric_price() / self.discount(), control_variate)
+        return self.discount() * mean, self.discount() * conf95
 
-        stockpath = geometric_brownian_motion(self.initial_price, self.volatility, self.interest_rate,
-                                              self.time_to_maturity, self.N, self.n)
+    def chunk_statistics(self, n, seed_sequence, sampling='standard'):
+        ''' Payoff statistics of one chunk of n paths drawn from its own seed sequence '''
+        return self.sample_statistics(n, np.random.default_rng(seed_sequence), sampling)
 
-        arithmetic_payoff = np.array([np.max([0, self.strike_price - np.mean(stockpath[:, i])]) for i in range(np.shape(stockpath)[1])])
-        geometric_payoff = np.array([np.max([0, self.strike_price - stats.mstats.gmean(stockpath[:, i])]) for i in range(np.shape(stockpath)[1])])
+    def instrumented_chunk_statistics(self, n, seed_sequence, sampling='standard'):
+        ''' chunk_statistics together with the SolverStats of the chunk, for worker processes '''
+        chunk_stats = SolverStats()
+        return self.sample_statistics(n, np.random.default_rng(seed_sequence), sampling, stats=chunk_stats), chunk_stats
 
-        price = np.exp(-self.interest_rate * self.time_to_maturity) * np.mean(arithmetic_payoff - geometric_payoff) + geometric_put_price
-        conf95 = 1.96 * np.std(arithmetic_payoff - geometric_payoff) / np.sqrt(self.n)
-        return price, conf95
+    def compute(self, chunk_size=None, seed=None, workers=1, control_variate='optimal', sampling='standard',
+                stats=None):
+        '''
+            Price from n simulated paths. With chunk_size the paths are consumed chunk by chunk
+            and only running payoff statistics are kept, so peak memory is bounded by the chunk.
+            With a seed (or workers > 1) each chunk gets an independent generator spawned from
+            the seed and the chunks are simulated on a pool of workers processes; the partial
+            statistics are merged in chunk order, so the result only depends on the seed and
+            the chunk layout, not on the number of workers.
+            control_variate selects beta (see estimate) and sampling the path generation (see
+            standard_normals). For 'sobol' every chunk is an independently scrambled point set
+            of a power of two points, the chunk size rounded up (see sample_count), and conf95
+            uses the i.i.d. formula, which overstates the quasi-random error.
+            stats (an Instrumentation.SolverStats) records the path generation, payoff,
+            statistics and estimate phases (summed over the workers), the path buffer and the
+            numbers of chunks and paths
+        '''
+        chunk_size = chunk_size or self.n
+        instrumented = stats is not None
+        stats = stats or NO_STATS
+        statistics = ControlVariateStatistics()
+        if workers > 1:
+            sizes = chunk_sizes(self.n, chunk_size)
+            chunk_function = self.instrumented_chunk_statistics if instrumented else self.chunk_statistics
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for chunk in pool.map(chunk_function, sizes, chunk_seeds(seed, len(sizes)), [sampling] * len(sizes)):
+                    if instrumented:
+                        chunk, chunk_stats = chunk
+                        stats.merge(chunk_stats)
+                    statistics.merge(chunk)
+                    stats.iterate('chunks')
+        else:
+            buffer = stats.allocate('path buffer',
+                                    np.empty(len(self.fixings()) * sample_count(chunk_size, sampling), self.dtype))
+            for size, rng in chunk_generators(self.n, chunk_size, seed):
+                statistics.merge(self.sample_statistics(size, rng, sampling, buffer, stats))
+                stats.iterate('chunks')
+        with stats.phase('estimate'):
+            return self.estimate(statistics, control_variate)
 
+    def compute_adaptive(self, tolerance, relative=False, max_paths=10**6, batch_size=10000, seed=None,
+                         control_variate='optimal', sampling='standard', stats=None):
+        '''
+            Sample batches of batch_size paths, updating the control variate estimate and its
+            confidence half-width after every batch, until conf95 <= tolerance (or tolerance
+            times the price if relative) or max_paths paths have been used. With a seed the
+            batches draw from the same streams as compute(chunk_size=batch_size, seed=seed).
+            For 'sobol' every batch is rounded up to a power of two paths (see sample_count).
+            Returns price, conf95 and the number of paths used. stats records the phases as in
+            compute, with the number of batches
+        '''
+        if max_paths < 1 or batch_size < 1:
+            raise ValueError(f'max_paths and batch_size must be at least 1, got {max_paths} and {batch_size}')
+        stats = stats or NO_STATS
+        seed_sequence = np.random.SeedSequence(seed) if seed is not None else None
+        statistics = ControlVariateStatistics()
+        buffer = stats.allocate('path buffer',
+                                np.empty(len(self.fixings()) * sample_count(batch_size, sampling), self.dtype))
+        paths = 0
+        while paths < max_paths:
+            size = min(batch_size, max_paths - paths)
+            rng = np.random.default_rng(seed_sequence.spawn(1)[0]) if seed_sequence is not None else None
+            statistics.merge(self.sample_statistics(size, rng, sampling, buffer, stats))
+            paths += sample_count(size, sampling)
+            stats.iterate('batches')
+            with stats.phase('estimate'):
+                price, conf95 = self.estimate(statistics, control_variate)
+            if conf95 <= (tolerance * abs(price) if relative else tolerance):
+                break
+        return price, conf95, paths
+
+    def sample_greeks(self, n, rng=None, sampling='standard', estimator='pathwise', stats=None) -> dict:
+        '''
+            Statistics of the (arithmetic, geometric) samples of the discounted payoff, delta,
+            vega and rho on n simulated paths (see fixing_sensitivities), by GREEKS. The
+            pathwise estimator differentiates the payoff along each path, the likelihood ratio
+            estimator weights the payoff by the score of the path density (the fixings at
+            t = 0 are s itself and enter delta pathwise). Antithetic pairs are averaged first
+        '''
+        if estimator not in GREEK_ESTIMATORS:
+            raise ValueError(f'Unknown estimator "{estimator}", expected one of {GREEK_ESTIMATORS}')
+        stats = stats or NO_STATS
+        with stats.phase('path generation'):
+            times = self.fixings()
+            arithmetic_remaining, geometric_remaining, terms = fixing_sensitivities(
+                self.initial_price, self.volatility, self.interest_rate, times, n, rng, sampling, self.dtype,
+                estimator)
+        stats.iterate('paths', sample_count(n, sampling))
+
+        with stats.phase('greeks'):
+            # Share of the remaining fixings (and of those at t = 0) in the average over all fixings
+            total = self.fixed_count + len(times)
+            remaining = len(times) / total
+            initial = np.sum(times <= 0) / total
+            discount = self.discount()
+            averages = self.seasoned_averages(arithmetic_remaining, geometric_remaining)
+            samples = {greek: [] for greek in GREEKS}
+            for name, average, remaining_average in zip(('arithmetic', 'geometric'), averages,
+                                                        (arithmetic_remaining, geometric_remaining)):
+                price = discount * self.payoff(average)
+                slope = discount * self.payoff_slope(average)
+                # Derivatives of the average through those of its remaining part (geometric: relative)
+                scale = remaining if name == 'arithmetic' else remaining * average / remaining_average
+                samples['price'].append(price)
+                if estimator == 'pathwise':
+                    samples['delta'].append(slope * scale * remaining_average / self.initial_price)
+                    samples['vega'].append(slope * scale * terms[f'{name} vega'])
+                    samples['rho'].append(slope * scale * terms[f'{name} rho'] - self.time_to_maturity * price)
+                else:
+                    direct = initial if name == 'arithmetic' else initial * average / self.initial_price
+                    samples['delta'].append(price * terms['delta score'] + slope * direct)
+                    samples['vega'].append(price * terms['vega score'])
+                    samples['rho'].append(price * (terms['rho score'] - self.time_to_maturity))
+            if sampling == 'antithetic':
+                pairs = sample_count(n, sampling) // 2
+                samples = {greek: [0.5 * (sample[:pairs] + sample[pairs:]) for sample in pair]
+                           for greek, pair in samples.items()}
+        with stats.phase('statistics'):
+            return {greek: ControlVariateStatistics().update(*pair) for greek, pair in samples.items()}
+
+    def compute_greeks(self, chunk_size=None, seed=None, control_variate='optimal', sampling='standard',
+                       estimator='pathwise', stats=None) -> dict:
+        '''
+            Price, delta, vega and rho from one set of n simulated paths, each with the
+            geometric average option as control variate against its closed form Greek (see
+            geometric_greeks), as {greek: (estimate, conf95)}. Chunks and seeds work as in
+            compute, so the price equals that of compute with the same chunk_size and seed.
+            estimator is 'pathwise' (default, lower variance for these payoffs) or
+            'likelihood ratio' (see sample_greeks). stats records the path generation,
+            greeks, statistics and estimate phases and the numbers of chunks and paths
+        '''
+        stats = stats or NO_STATS
+        statistics = {greek: ControlVariateStatistics() for greek in GREEKS}
+        for size, rng in chunk_generators(self.n, chunk_size or self.n, seed):
+            for greek, chunk in self.sample_greeks(size, rng, sampling, estimator, stats).items():
+                statistics[greek].merge(chunk)
+            stats.iterate('chunks')
+        with stats.phase('estimate'):
+            exact = self.geometric_greeks()
+            return {greek: control_variate_estimate(statistics[greek], exact[greek], control_variate)
+                    for greek in GREEKS}
+
+class CVMCAsianCallOption(CVMCAsianOption):
+    '''
+        Compute risk-neutral price of Asian call with control variate MC with geometric price as CV
+    '''
+    option_type = 'call'
+
+    def __init__(self, initial_price, volatility, interest_rate, time_to_maturity, strike_price, N, n,
+                 dtype=np.float64, fixing_times=None, fixed_average=None, fixed_count=0):
+        super(CVMCAsianCallOption, self).__init__(initial_price, volatility, interest_rate,
+                                                  time_to_maturity, strike_price, N, n, dtype,
+                                                  fixing_times, fixed_average, fixed_count)
+
+    def payoff(self, average):
+        return np.maximum(average - self.strike_price, 0)
+
+    def payoff_slope(self, average):
+        return (average > self.strike_price).astype(np.float64)
+
+
+class CVMCAsianPutOption(CVMCAsianOption):
+    '''
+        Compute risk-neutral price of Asian put with control variate MC with geometric price as CV
+    '''
+    option_type = 'put'
+
+    def __init__(self, initial_price, volatility, interest_rate, time_to_maturity, strike_price, N, n,
+                 dtype=np.float64, fixing_times=None, fixed_average=None, fixed_count=0):
+        super(CVMCAsianPutOption, self).__init__(initial_price, volatility, interest_rate,
+                                                 time_to_maturity, strike_price, N, n, dtype,
+                                                 fixing_times, fixed_average, fixed_count)
+
+    def payoff(self, average):
+        return np.maximum(self.strike_price - average, 0)
+
+    def payoff_slope(self, average):
+        return -(average < self.strike_price).astype(np.float64)
+
+
+def price_book(options, n=None, chunk_size=None, seed=None, control_variate='optimal', sampling='standard',
+               stats=None):
+    '''
+        (price, conf95) of every CVMC Asian option of a book, in order. The options on the same
+        underlying (initial price, volatility, interest rate and dtype) are priced from one
+        shared set of n paths (default the largest n of the group) simulated on the union of
+        their fixing times, so a chunk costs one simulation plus two matrix products mapping
+        the log returns and prices at the union onto the fixing averages of every option.
+        Chunks, seeds, sampling and stats work as in CVMCAsianOption.compute
+    '''
+    stats = stats or NO_STATS
+    groups = defaultdict(list)
+    for index, option in enumerate(options):
+        groups[(option.initial_price, option.volatility, option.interest_rate, np.dtype(option.dtype))].append(index)
 
+    results = [None] * len(options)
+    for (initial_price, volatility, interest_rate, dtype), indices in groups.items():
+        group = [options[index] for index in indices]
+        paths = n or max(option.n for option in group)
+        times = np.unique(np.concatenate([option.fixings() for option in group]))
+        simulated = times[times > 0]
 
+        # weights[k, j] counts the fixings of option k at simulated time j, fixings at t = 0 are s
+        weights = np.zeros((len(group), len(simulated)))
+        at_start = np.zeros((len(group), 1))
+        for k, option in enumerate(group):
+            fixings = option.fixings()
+            np.add.at(weights[k], np.searchsorted(simulated, fixings[fixings > 0]), 1)
+            at_start[k] = np.count_nonzero(fixings == 0)
+        counts = np.maximum(weights.sum(axis=1, keepdims=True) + at_start, 1)
 
+        statistics = [ControlVariateStatistics() for _ in group]
+        group_chunk_size = chunk_size or paths
+        buffer = stats.allocate('path buffer', np.empty(len(simulated) * sample_count(group_chunk_size, sampling), dtype))
+        for size, rng in chunk_generators(paths, group_chunk_size, seed):
+            columns = sample_count(size, sampling)
+            with stats.phase('path generation'):
+                X = log_returns(volatility, interest_rate, simulated, size, rng, sampling, dtype,
+                                out=buffer[:len(simulated) * columns].reshape(len(simulated), columns))
+                log_sums = np.matmul(weights, X)
+                np.exp(X, out=X)
+                arithmetic_averages = initial_price * (at_start + np.matmul(weights, X)) / counts
+                geometric_averages = initial_price * np.exp(log_sums / counts)
+            stats.iterate('paths', columns)
+            stats.iterate('chunks')
+            for k, option in enumerate(group):
+                statistics[k].merge(option.payoff_statistics(arithmetic_averages[k], geometric_averages[k], sampling,
+                                                             stats))
 
+        with stats.phase('estimate'):
+            for k, index in enumerate(indices):
+                results[index] = options[index].estimate(statistics[k], control_variate)
+    return results
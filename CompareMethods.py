@@ -1,104 +1,40 @@
-import CVMCOptions
-import AsianOptions
+import ParameterSweep
+import Plotting
+import ResultStore
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+import os
 from collections import defaultdict
-sns.set_style('darkgrid')
 
-def cvmc_vs_fds_volatility(volatilities: list, interest_rate: float,
-                time_to_maturity: int, strike_price, initial_price) -> defaultdict:
-    prices = defaultdict(list)
-    for vol in volatilities:
-        print(f'Volatility: {vol}')
-        # Call options
-        CVMC_asian_call = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=vol,
-                                                          interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                          strike_price=strike_price, N=500, n=1000)
-        FDS_asian_call = AsianOptions.AsianCallOption(initial_price=initial_price, volatility=vol,
-                                                      interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                      strike_price=strike_price, time_partition_size=500,
-                                                      spatial_partition_size=1000)
-
-        cvmc_call_price, cvmc_call_conf95 = CVMC_asian_call.compute()
-        fds_call_price = FDS_asian_call.solve()
-        #print(f'PDE Call: {fds_call_price}')
-        #print(f'CVMC Call: {cvmc_call_price}')
-
-
-        # Put options
-        CVMC_asian_put = CVMCOptions.CVMCAsianPutOption(initial_price=initial_price, volatility=vol,
-                                                          interest_rate=interest_rate,
-                                                          time_to_maturity=time_to_maturity,
-                                                          strike_price=strike_price, N=500, n=1000)
-        FDS_asian_put = AsianOptions.AsianPutOption(initial_price=initial_price, volatility=vol,
-                                                      interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                      strike_price=strike_price, time_partition_size=500,
-                                                      spatial_partition_size=1000)
+# Methods compared in the sweeps as (label, pricer, settings), see ParameterSweep.run_sweep.
+# CVMC samples batches of n paths until conf95 is within 0.5% of the price
+METHODS = [('FDS', 'FDS', {'time_partition_size': 500, 'spatial_partition_size': 1000}),
+           ('CVMC', 'CVMC', {'N': 500, 'n': 1000, 'tolerance': 0.005, 'relative': True, 'max_paths': 10**5})]
 
-        cvmc_put_price, cvmc_put_conf95 = CVMC_asian_put.compute()
-        fds_put_price = FDS_asian_put.solve()
-        #print(f'PDE Put: {fds_put_price}')
-        #print(f'CVMC Put: {cvmc_put_price}')
-        print('\n')
 
-
-        # Store prices and 95% confidence values
-        prices["FDS call"].append(fds_call_price)
-        prices["FDS put"].append(fds_put_price)
-        prices["CVMC call"].append(cvmc_call_price)
-        prices["CVMC put"].append(cvmc_put_price)
-        prices["CVMC call conf95"].append(cvmc_call_conf95)
-        prices["CVMC put conf95"].append(cvmc_put_conf95)
-
-    return prices
+def cvmc_vs_fds_volatility(volatilities: list, interest_rate: float,
+                time_to_maturity: int, strike_price, initial_price, workers=1, store=None,
+                instrument=False) -> defaultdict:
+    grid = [dict(initial_price=initial_price, strike_price=strike_price, interest_rate=interest_rate,
+                 volatility=vol, time_to_maturity=time_to_maturity) for vol in volatilities]
+    return ParameterSweep.run_sweep(grid, METHODS, workers=workers, store=store, instrument=instrument)
 
 def cvmc_vs_fds_init_price(initial_prices: list, interest_rate: float,
-                time_to_maturity: int, strike_price, volatility) -> defaultdict:
-    prices = defaultdict(list)
-    for init_price in initial_prices:
-        print(f'Init price: {init_price}')
-        # Call options
-        CVMC_asian_call = CVMCOptions.CVMCAsianCallOption(initial_price=init_price, volatility=volatility,
-                                                          interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                          strike_price=strike_price, N=500, n=1000)
-        FDS_asian_call = AsianOptions.AsianCallOption(initial_price=init_price, volatility=volatility,
-                                                      interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                      strike_price=strike_price, time_partition_size=500,
-                                                      spatial_partition_size=1000)
-
-        cvmc_call_price, cvmc_call_conf95 = CVMC_asian_call.compute()
-        fds_call_price = FDS_asian_call.solve()
-        #print(f'PDE Call: {fds_call_price}')
-        #print(f'CVMC Call: {cvmc_call_price}')
-
-        # Put options
-        CVMC_asian_put = CVMCOptions.CVMCAsianPutOption(initial_price=init_price, volatility=volatility,
-                                                          interest_rate=interest_rate,
-                                                          time_to_maturity=time_to_maturity,
-                                                          strike_price=strike_price, N=500, n=1000)
-        FDS_asian_put = AsianOptions.AsianPutOption(initial_price=init_price, volatility=volatility,
-                                                      interest_rate=interest_rate, time_to_maturity=time_to_maturity,
-                                                      strike_price=strike_price, time_partition_size=500,
-                                                      spatial_partition_size=1000)
-
-        cvmc_put_price, cvmc_put_conf95 = CVMC_asian_put.compute()
-        fds_put_price = FDS_asian_put.solve()
-        #print(f'PDE Put: {fds_put_price}')
-        #print(f'CVMC Put: {cvmc_put_price}')
-        #print('\n')
-
-        # Store prices and 95% confidence values
-        prices["FDS call"].append(fds_call_price)
-        prices["FDS put"].append(fds_put_price)
-        prices["CVMC call"].append(cvmc_call_price)
-        prices["CVMC put"].append(cvmc_put_price)
-        prices["CVMC call conf95"].append(cvmc_call_conf95)
-        prices["CVMC put conf95"].append(cvmc_put_conf95)
-
-    return prices
-
-def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike_price=None):
+                time_to_maturity: int, strike_price, volatility, workers=1, store=None,
+                instrument=False) -> defaultdict:
+    grid = [dict(initial_price=init_price, strike_price=strike_price, interest_rate=interest_rate,
+                 volatility=volatility, time_to_maturity=time_to_maturity) for init_price in initial_prices]
+    return ParameterSweep.run_sweep(grid, METHODS, workers=workers, store=store, instrument=instrument)
+
+def print_phase_breakdown(prices: defaultdict):
+    ''' Per-phase breakdown of every method of an instrumented sweep (points loaded from the store excluded) '''
+    for label, _, _ in METHODS:
+        if f'{label} stats' in prices:
+            print(f'{label}:')
+            print(prices[f'{label} stats'].breakdown())
+
+def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike_price=None, show=True):
+    ''' Plot the sweep and save it under Results, showing the figure if show and else only writing the file '''
+    plt = Plotting.pyplot()
     fds_call_prices = prices["FDS call"]
     fds_put_prices = prices["FDS put"]
     cvmc_call_prices = prices["CVMC call"]
@@ -135,17 +71,26 @@ def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike
     plt.legend()
     plt.ylabel(r'Price function $\Pi(0)$')
     plt.savefig(f'./Results/comparison_method_{varying_factor.split(" ")[0]}.png')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
 
 
 if __name__ == '__main__':
+    # Points priced by earlier runs are loaded instead of recomputed
+    store = ResultStore.ResultStore()
     vol_prices = cvmc_vs_fds_volatility(volatilities=[0.1 + 0.1 * i for i in range(49)], interest_rate=0.05,
-                                        time_to_maturity=1, strike_price=50, initial_price=50)
+                                        time_to_maturity=1, strike_price=50, initial_price=50,
+                                        workers=os.cpu_count(), store=store, instrument=True)
     print(f'Done with volatility')
+    print_phase_breakdown(vol_prices)
     s0_prices = cvmc_vs_fds_init_price(initial_prices=[10 + i * 5 for i in range(18)], interest_rate=0.05,
-                                        time_to_maturity=1, strike_price=50, volatility=0.5)
+                                        time_to_maturity=1, strike_price=50, volatility=0.5,
+                                        workers=os.cpu_count(), store=store, instrument=True)
     print(f'Done with prices')
+    print_phase_breakdown(s0_prices)
 
 
 
@@ -1,147 +1,65 @@
 import AsianOptions
-import StandardEuropeanOptions
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style('darkgrid')
+import CVMCOptions
+import ParameterSweep
+import Plotting
+import ResultStore
 from collections import defaultdict
 import numpy as np
+import os
+
+
+# Options compared in the sweeps as (label, pricer, settings), see ParameterSweep.run_sweep
+OPTIONS = [('Asian', 'FDS', {'time_partition_size': 100, 'spatial_partition_size': 500}),
+           ('Standard', 'Black-Scholes', {})]
 
 
 def different_volatilities(volatilities: list, interest_rate=0.05,
-                           time_to_maturity=1, strike_price=12, initial_price=10):
+                           time_to_maturity=1, strike_price=12, initial_price=10, workers=1, store=None):
     if not isinstance(volatilities, list):
         raise ValueError(f'"volatilities" is not of type list!')
 
-    prices = defaultdict(list)
-    for vol in volatilities:
-        # Call options for different volatilities
-        asian_call = AsianOptions.AsianCallOption(initial_price=initial_price,
-                                                  strike_price=strike_price,
-                                                  interest_rate=interest_rate,
-                                                  volatility=vol,
-                                                  time_to_maturity=time_to_maturity,
-                                                  time_partition_size=100,
-                                                  spatial_partition_size=500)
-
-        standard_call = StandardEuropeanOptions.StandardCallOption(initial_price=initial_price,
-                                                                   strike_price=strike_price,
-                                                                   interest_rate=interest_rate,
-                                                                   volatility=vol,
-                                                                   time_to_maturity=time_to_maturity)
-        asian_call_price = asian_call.solve()
-        standard_call_price = standard_call.compute()
-
-        # Put options for different volatilities
-        asian_put = AsianOptions.AsianPutOption(initial_price=initial_price,
-                                                  strike_price=strike_price,
-                                                  interest_rate=interest_rate,
-                                                  volatility=vol,
-                                                  time_to_maturity=time_to_maturity,
-                                                  time_partition_size=100,
-                                                  spatial_partition_size=500)
-        standard_put = StandardEuropeanOptions.StandardPutOption(initial_price=initial_price,
-                                                                   strike_price=strike_price,
-                                                                   interest_rate=interest_rate,
-                                                                   volatility=vol,
-                                                                   time_to_maturity=time_to_maturity)
-
-        asian_put_price = asian_put.solve()
-        standard_put_price = standard_put.compute()
-
-        # Store prices
-        prices["Asian call"].append(asian_call_price)
-        prices["Asian put"].append(asian_put_price)
-        prices["Standard call"].append(standard_call_price)
-        prices["Standard put"].append(standard_put_price)
-
-    return prices
+    grid = [dict(initial_price=initial_price, strike_price=strike_price, interest_rate=interest_rate,
+                 volatility=vol, time_to_maturity=time_to_maturity) for vol in volatilities]
+    return ParameterSweep.run_sweep(grid, OPTIONS, workers=workers, store=store)
 
 
 def different_initial_prices(initial_prices: list, strike_price, interest_rate=0.05,
-                             time_to_maturity=1,  volatility=0.5):
+                             time_to_maturity=1,  volatility=0.5, workers=1, store=None):
     if not isinstance(initial_prices, list):
         raise ValueError(f'"initial_prices" is not of type list!')
 
-    prices = defaultdict(list)
-    for pr_idx, init_pr in enumerate(initial_prices):
-        # Call options for different volatilities
-        asian_call = AsianOptions.AsianCallOption(initial_price=init_pr,
-                                                  strike_price=strike_price,
-                                                  interest_rate=interest_rate,
-                                                  volatility=volatility,
-                                                  time_to_maturity=time_to_maturity,
-                                                  time_partition_size=100,
-                                                  spatial_partition_size=500)
-
-        standard_call = StandardEuropeanOptions.StandardCallOption(initial_price=init_pr,
-                                                                  strike_price=strike_price,
-                                                                  interest_rate=interest_rate,
-                                                                  volatility=volatility,
-                                                                  time_to_maturity=time_to_maturity)
-        asian_call_price = asian_call.solve()
-        standard_call_price = standard_call.compute()
-
-        # Put options for different volatilities
-        asian_put = AsianOptions.AsianPutOption(initial_price=init_pr,
-                                                  strike_price=strike_price,
-                                                  interest_rate=interest_rate,
-                                                  volatility=volatility,
-                                                  time_to_maturity=time_to_maturity,
-                                                  time_partition_size=100,
-                                                  spatial_partition_size=500)
-        standard_put = StandardEuropeanOptions.StandardPutOption(initial_price=init_pr,
-                                                                  strike_price=strike_price,
-                                                                  interest_rate=interest_rate,
-                                                                  volatility=volatility,
-                                                                  time_to_maturity=time_to_maturity)
+    grid = [dict(initial_price=init_pr, strike_price=strike_price, interest_rate=interest_rate,
+                 volatility=volatility, time_to_maturity=time_to_maturity) for init_pr in initial_prices]
+    return ParameterSweep.run_sweep(grid, OPTIONS, workers=workers, store=store)
 
-        asian_put_price = asian_put.solve()
-        standard_put_price = standard_put.compute()
-
-        # Store prices
-        prices["Asian call"].append(asian_call_price)
-        prices["Asian put"].append(asian_put_price)
-        prices["Standard call"].append(standard_call_price)
-        prices["Standard put"].append(standard_put_price)
-
-    return prices
-
-def put_call_parity(initial_price=20, strike_price=12, interest_rate=0.05,
-                    volatility=0.5, time_to_maturity=1, confidence=0.05):
-
-    # Numerical prices
-    asian_call = AsianOptions.AsianCallOption(initial_price=initial_price,
-                                              strike_price=strike_price,
-                                              interest_rate=interest_rate,
-                                              volatility=volatility,
-                                              time_to_maturity=time_to_maturity,
-                                              time_partition_size=100,
-                                              spatial_partition_size=500)
+def put_against_monte_carlo(initial_price=20, strike_price=22, interest_rate=0.05,
+                            volatility=0.5, time_to_maturity=1, N=1000, n=50000, seed=0):
+    '''
+        Check the FDS put (priced from the call grid by put-call parity) against an
+        independent CVMC put with N fixings, which approximates the continuous average
+    '''
     asian_put = AsianOptions.AsianPutOption(initial_price=initial_price,
-                                              strike_price=strike_price,
-                                              interest_rate=interest_rate,
-                                              volatility=volatility,
-                                              time_to_maturity=time_to_maturity,
-                                              time_partition_size=100,
-                                              spatial_partition_size=500)
-    asian_call_price = asian_call.solve()
-    asian_put_price = asian_put.solve()
-
-    numerical_pcp = asian_call_price - asian_put_price
-
-    # Analytical formula
-    analytical_pcp = initial_price / (interest_rate * time_to_maturity) * \
-                     (1 - np.exp(-interest_rate * time_to_maturity)) - strike_price * np.exp(-interest_rate*time_to_maturity)
-
-    ratio = 1 - numerical_pcp / analytical_pcp
-
-    if ratio <= confidence:
-        print(f'Put-call parity ratio is within confidence! ({ratio:.4f} < {confidence})')
+                                            strike_price=strike_price,
+                                            interest_rate=interest_rate,
+                                            volatility=volatility,
+                                            time_to_maturity=time_to_maturity,
+                                            time_partition_size=400,
+                                            spatial_partition_size=800)
+    cvmc_put = CVMCOptions.CVMCAsianPutOption(initial_price, volatility, interest_rate, time_to_maturity,
+                                              strike_price, N, n)
+    fds_price = asian_put.solve(richardson=True)
+    cvmc_price, conf95 = cvmc_put.compute(seed=seed)
+
+    difference = abs(fds_price - cvmc_price)
+    if difference <= conf95:
+        print(f'FDS put agrees with CVMC! (|{fds_price:.4f} - {cvmc_price:.4f}| = {difference:.4f} <= {conf95:.4f})')
     else:
-        print(f'Put-call parity not fulfilled, ratio is outside of confidence! ({ratio:.4f} > {confidence})')
+        print(f'FDS put differs from CVMC! (|{fds_price:.4f} - {cvmc_price:.4f}| = {difference:.4f} > {conf95:.4f})')
 
 
-def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike_price=None):
+def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike_price=None, show=True):
+    ''' Plot the sweep and save it under Results, showing the figure if show and else only writing the file '''
+    plt = Plotting.pyplot()
     asian_call_prices = prices["Asian call"]
     asian_put_prices = prices["Asian put"]
     standard_call_prices = prices["Standard call"]
@@ -167,15 +85,20 @@ def plot_prices(prices: defaultdict, x_values: list, varying_factor: str, strike
     plt.legend()
     plt.ylabel(r'Price function $\Pi(0)$')
     plt.savefig(f'./Results/comparison_{varying_factor.split(" ")[0]}.png')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
 
 if __name__ == '__main__':
+    # Points priced by earlier runs are loaded instead of recomputed
+    store = ResultStore.ResultStore()
     vol_prices = different_volatilities([0+0.2*i for i in range(50)], interest_rate=0.05,
-                           time_to_maturity=1, strike_price=12, initial_price=10)
+                           time_to_maturity=1, strike_price=12, initial_price=10, workers=os.cpu_count(), store=store)
     s0_prices = different_initial_prices([10+i*5 for i in range(18)], strike_price=50,
-                             interest_rate=0.05, time_to_maturity=1,  volatility=0.5)
+                             interest_rate=0.05, time_to_maturity=1,  volatility=0.5, workers=os.cpu_count(), store=store)
     plot_prices(vol_prices, [0+0.2*i for i in range(50)], 'volatility')
     plot_prices(s0_prices, [10+i*5 for i in range(18)], 'initial price', strike_price=50)
-    put_call_parity()
+    put_against_monte_carlo()
     
\ No newline at end of file
@@ -0,0 +1,91 @@
+import contextlib
+import cProfile
+import pstats
+import time
+from collections import defaultdict
+
+
+class SolverStats(object):
+    '''
+        Per-phase wall times and call counts, allocation sizes (bytes) and iteration counts
+        recorded by the solvers when passed as stats=. Stats of several solves (or of worker
+        processes, being picklable) are combined with merge
+    '''
+    def __init__(self):
+        super(SolverStats, self).__init__()
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.allocations = defaultdict(int)
+        self.iterations = defaultdict(int)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timings[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def allocate(self, name, array):
+        self.allocations[name] += array.nbytes
+        return array
+
+    def iterate(self, name, count=1):
+        self.iterations[name] += count
+
+    def merge(self, other):
+        for mine, theirs in ((self.timings, other.timings), (self.calls, other.calls),
+                             (self.allocations, other.allocations), (self.iterations, other.iterations)):
+            for name, value in theirs.items():
+                mine[name] += value
+        return self
+
+    def as_dict(self) -> dict:
+        return {'timings': dict(self.timings), 'calls': dict(self.calls), 'allocations': dict(self.allocations),
+                'iterations': dict(self.iterations)}
+
+    def breakdown(self) -> str:
+        ''' Table of the phases by time with their share of the total, then allocations and iterations '''
+        total = sum(self.timings.values()) or 1
+        lines = [f'{"phase":>20} {"time [s]":>10} {"share":>7} {"calls":>8}']
+        for name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append(f'{name:>20} {seconds:10.4f} {seconds / total:7.1%} {self.calls[name]:8d}')
+        lines += [f'{name:>20} {size / 1e6:10.2f} MB allocated' for name, size in self.allocations.items()]
+        lines += [f'{name:>20} {count:10d} iterations' for name, count in self.iterations.items()]
+        return '\n'.join(lines)
+
+
+class NoStats(object):
+    ''' Stand-in for SolverStats when no stats are requested, every hook is a no-op '''
+    context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self.context
+
+    def allocate(self, name, array):
+        return array
+
+    def iterate(self, name, count=1):
+        pass
+
+    def merge(self, other):
+        return self
+
+
+NO_STATS = NoStats()
+
+
+def profile(function, *args, path=None, sort='cumulative', limit=20, **kwargs):
+    '''
+        Run function under cProfile, print the limit most expensive entries by sort and dump
+        the raw profile to path (for snakeviz, gprof2dot, pstats) if given. Returns the
+        result of the function together with the pstats.Stats
+    '''
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    statistics = pstats.Stats(profiler).sort_stats(sort)
+    statistics.print_stats(limit)
+    if path is not None:
+        statistics.dump_stats(path)
+    return result, statistics
@@ -0,0 +1,207 @@
+import AsianOptions
+import CVMCOptions
+import StandardEuropeanOptions
+import numpy as np
+import itertools
+import time
+from collections import defaultdict
+from Instrumentation import NO_STATS, SolverStats
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def fds_grid_prices(points: list, interest_rate, time_to_maturity, time_partition_size=500,
+                    spatial_partition_size=1000, interpolation='linear', richardson=False, store=None,
+                    stats=None) -> list:
+    '''
+        FDS call and put prices for all (strike, initial price, volatility) points sharing one
+        rate and maturity. The grids of all volatilities are stepped together by
+        AsianOptions.solve_volatilities and each prices all points of its volatility. With a
+        ResultStore the grids are instead loaded from (or solved into) its memory-mapped files
+    '''
+    volatilities = sorted({point['volatility'] for point in points})
+
+    def solved(time_partition_size, spatial_partition_size):
+        if store is not None:
+            return [store.grid(interest_rate, volatility, time_to_maturity, time_partition_size,
+                               spatial_partition_size, stats=stats) for volatility in volatilities]
+        return AsianOptions.solve_volatilities(interest_rate, volatilities, time_to_maturity, time_partition_size,
+                                               spatial_partition_size, stats=stats)
+
+    grids = dict(zip(volatilities, solved(time_partition_size, spatial_partition_size)))
+    if richardson:
+        coarse_grids = dict(zip(volatilities, solved(time_partition_size // 2, spatial_partition_size // 2)))
+    results = [None] * len(points)
+    for volatility, grid in grids.items():
+        indices = [index for index, point in enumerate(points) if point['volatility'] == volatility]
+        strike_prices = [points[index]['strike_price'] for index in indices]
+        initial_prices = [points[index]['initial_price'] for index in indices]
+        if richardson:
+            coarse = coarse_grids[volatility]
+            calls = AsianOptions.richardson_prices(grid, coarse, strike_prices, initial_prices, 'call',
+                                                   interpolation, stats=stats)
+            puts = AsianOptions.richardson_prices(grid, coarse, strike_prices, initial_prices, 'put',
+                                                  interpolation, stats=stats)
+        else:
+            calls = grid.prices(strike_prices, initial_prices, 'call', interpolation, stats)
+            puts = grid.prices(strike_prices, initial_prices, 'put', interpolation, stats)
+        for index, call, put in zip(indices, np.atleast_1d(calls), np.atleast_1d(puts)):
+            results[index] = {'call': call, 'put': put}
+    return results
+
+
+def cvmc_prices(initial_price, strike_price, interest_rate, volatility, time_to_maturity,
+                N=500, n=1000, chunk_size=None, seed=None, tolerance=None, relative=False,
+                max_paths=10**6, control_variate='optimal', sampling='standard', stats=None) -> dict:
+    ''' CVMC call and put prices from n paths, or adaptively until conf95 meets tolerance if given '''
+    call = CVMCOptions.CVMCAsianCallOption(initial_price=initial_price, volatility=volatility,
+                                           interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                           strike_price=strike_price, N=N, n=n)
+    put = CVMCOptions.CVMCAsianPutOption(initial_price=initial_price, volatility=volatility,
+                                         interest_rate=interest_rate, time_to_maturity=time_to_maturity,
+                                         strike_price=strike_price, N=N, n=n)
+    if tolerance is not None:
+        batch_size = chunk_size or n
+        call_price, call_conf95, call_paths = call.compute_adaptive(tolerance, relative, max_paths, batch_size, seed,
+                                                                    control_variate, sampling, stats)
+        put_price, put_conf95, put_paths = put.compute_adaptive(tolerance, relative, max_paths, batch_size, seed,
+                                                                control_variate, sampling, stats)
+    else:
+        call_price, call_conf95 = call.compute(chunk_size=chunk_size, seed=seed, control_variate=control_variate,
+                                               sampling=sampling, stats=stats)
+        put_price, put_conf95 = put.compute(chunk_size=chunk_size, seed=seed, control_variate=control_variate,
+                                            sampling=sampling, stats=stats)
+        call_paths = put_paths = n
+    return {'call': call_price, 'put': put_price, 'call conf95': call_conf95, 'put conf95': put_conf95,
+            'call paths': call_paths, 'put paths': put_paths}
+
+
+def black_scholes_prices(initial_price, strike_price, interest_rate, volatility, time_to_maturity, stats=None) -> dict:
+    with (stats or NO_STATS).phase('pricing'):
+        return {'call': StandardEuropeanOptions.black_scholes_price(initial_price, strike_price, interest_rate,
+                                                                    volatility, time_to_maturity, is_call=True),
+                'put': StandardEuropeanOptions.black_scholes_price(initial_price, strike_price, interest_rate,
+                                                                   volatility, time_to_maturity, is_call=False)}
+
+
+PRICERS = {'CVMC': cvmc_prices, 'Black-Scholes': black_scholes_prices}
+
+# Pricers that price a whole batch of grid points in one job, together with the parameters
+# the points of a batch must share (the remaining ones are passed per point)
+BATCH_PRICERS = {'FDS': (fds_grid_prices, ('interest_rate', 'time_to_maturity'))}
+
+
+def parameter_grid(**parameters) -> list:
+    ''' All combinations of the given parameter values as a list of dicts (last parameter varies fastest) '''
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*parameters.values())]
+
+
+def run_job(pricer, points: list, settings: dict, store=None, instrument=False):
+    '''
+        Price the grid points of one job with one pricer, returning the results per point, the
+        wall time and, if instrument, the SolverStats of the job (else None). BATCH_PRICERS
+        keep their solved grids in the store if given
+    '''
+    stats = SolverStats() if instrument else None
+    start = time.perf_counter()
+    if pricer in BATCH_PRICERS:
+        batch_pricer, shared = BATCH_PRICERS[pricer]
+        results = batch_pricer(points, **{name: points[0][name] for name in shared}, **settings, store=store,
+                               stats=stats)
+    else:
+        results = [PRICERS[pricer](**parameters, **settings, stats=stats) for parameters in points]
+    return results, time.perf_counter() - start, stats
+
+
+def make_jobs(grid: list, pricers: list, store=None) -> list:
+    '''
+        Split a sweep into (indices, label, pricer, settings) jobs: one per grid point, except
+        for BATCH_PRICERS where all grid points sharing the batch parameters form one job.
+        Grid points already in the store (if given) are left out
+    '''
+    jobs = []
+    for label, pricer, settings in pricers:
+        indices = [index for index, parameters in enumerate(grid)
+                   if store is None or not store.contains(store.key(pricer, parameters, settings))]
+        if pricer in BATCH_PRICERS:
+            batches = defaultdict(list)
+            for index in indices:
+                batches[tuple(grid[index][name] for name in BATCH_PRICERS[pricer][1])].append(index)
+            jobs.extend((batch, label, pricer, settings) for batch in batches.values())
+        else:
+            jobs.extend(([index], label, pricer, settings) for index in indices)
+    return jobs
+
+
+def stored_results(grid: list, pricers: list, store):
+    ''' (indices, label, results, wall_time, None) of the grid points already in the store, one point at a time '''
+    for label, pricer, settings in pricers:
+        for index, parameters in enumerate(grid):
+            key = store.key(pricer, parameters, settings)
+            if store.contains(key):
+                result, wall_time = store.load_result(key)
+                yield [index], label, [result], wall_time, None
+
+
+def store_results(store, grid: list, indices: list, pricer, settings: dict, results: list, wall_time):
+    for index, result in zip(indices, results):
+        store.save_result(store.key(pricer, grid[index], settings), result, wall_time,
+                          description={'pricer': pricer, 'parameters': grid[index], 'settings': settings})
+
+
+def iterate_sweep(grid: list, pricers: list, workers=1, store=None, instrument=False):
+    '''
+        Run the jobs of a sweep and yield (indices, label, results, wall_time, stats) as they
+        finish, with one result per grid index and stats the SolverStats of the job if
+        instrument (None otherwise and for stored points). pricers is a list of (label, pricer, settings) with
+        pricer a key of PRICERS or BATCH_PRICERS and settings the method keywords (grid sizes, path counts, ...).
+        With workers > 1 the independent jobs are fanned out over a process pool and arrive
+        in completion order. With a ResultStore the points stored by earlier runs (same
+        pricer, parameters and settings) are yielded first from the store and only the
+        missing ones are priced and stored
+    '''
+    if store is not None:
+        yield from stored_results(grid, pricers, store)
+    jobs = make_jobs(grid, pricers, store)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_job, pricer, [grid[index] for index in indices], settings, store, instrument):
+                       (indices, label, pricer, settings) for indices, label, pricer, settings in jobs}
+            for future in as_completed(futures):
+                indices, label, pricer, settings = futures[future]
+                results, wall_time, stats = future.result()
+                if store is not None:
+                    store_results(store, grid, indices, pricer, settings, results, wall_time)
+                yield indices, label, results, wall_time, stats
+    else:
+        for indices, label, pricer, settings in jobs:
+            results, wall_time, stats = run_job(pricer, [grid[index] for index in indices], settings, store,
+                                                instrument)
+            if store is not None:
+                store_results(store, grid, indices, pricer, settings, results, wall_time)
+            yield indices, label, results, wall_time, stats
+
+
+def run_sweep(grid: list, pricers: list, workers=1, verbose=True, store=None, instrument=False) -> defaultdict:
+    '''
+        Collect a sweep into the defaultdict(list) shape of the plotting functions, i.e.
+        prices[f'{label} call'][index] for every grid point in grid order, together with the
+        wall time of the job each point was priced in under f'{label} wall time'. If
+        instrument, the SolverStats of all jobs of a method are merged under f'{label} stats'
+    '''
+    slots = defaultdict(lambda: [None] * len(grid))
+    method_stats = defaultdict(SolverStats)
+    for indices, label, results, wall_time, stats in iterate_sweep(grid, pricers, workers, store, instrument):
+        for index, point_results in zip(indices, results):
+            for key, value in point_results.items():
+                slots[f'{label} {key}'][index] = value
+            slots[f'{label} wall time'][index] = wall_time
+        if stats is not None:
+            method_stats[label].merge(stats)
+        if verbose:
+            print(f'{label} {[grid[index] for index in indices]}: {wall_time:.3f} s')
+
+    prices = defaultdict(list)
+    prices.update(slots)
+    prices.update({f'{label} stats': stats for label, stats in method_stats.items()})
+    return prices
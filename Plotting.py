@@ -0,0 +1,6 @@
+def pyplot():
+    ''' matplotlib.pyplot styled by seaborn, imported on first plot so the sweeps run without the plotting libraries '''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style('darkgrid')
+    return plt
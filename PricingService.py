@@ -0,0 +1,206 @@
+import AsianApproximations
+import StandardEuropeanOptions
+import asyncio
+import numpy as np
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+# A contract as priced by the batch functions, see AsianApproximations.fds_fallback
+CONTRACT_FIELDS = ('initial_price', 'strike_price', 'interest_rate', 'volatility', 'time_to_maturity', 'is_call')
+
+
+def fds_batch(contracts, settings):
+    return AsianApproximations.fds_fallback(contracts, **settings)
+
+
+def cvmc_batch(contracts, settings):
+    return AsianApproximations.cvmc_fallback(contracts, **settings)
+
+
+def asian_batch(contracts, settings):
+    result = AsianApproximations.price_asian_options(*np.array(contracts).T, **settings)
+    return np.atleast_1d(result['price']), np.atleast_1d(result['error'])
+
+
+def black_scholes_batch(contracts, settings):
+    initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call = np.array(contracts).T
+    price = StandardEuropeanOptions.black_scholes_price(initial_price, strike_price, interest_rate, volatility,
+                                                        time_to_maturity, is_call.astype(np.bool_))
+    return np.atleast_1d(price), np.zeros(len(contracts))
+
+
+# Batch function of every pricer, the contract fields the requests of one batch must share
+# (the solver setup beyond the settings) and whether the batch runs in the worker pool. FDS
+# batches share the rate and maturity so they step one grid per volatility (see solve_volatilities),
+# CVMC batches share paths per underlying (see price_book)
+PRICERS = {'FDS': (fds_batch, ('interest_rate', 'time_to_maturity'), True),
+           'CVMC': (cvmc_batch, (), True),
+           'Asian': (asian_batch, (), True),
+           'Black-Scholes': (black_scholes_batch, (), False)}
+
+
+class PricingService(object):
+    '''
+        Asyncio front-end of the pricers. Concurrent requests with the same pricer, settings
+        and shared contract fields (see PRICERS) are coalesced for window seconds (or until
+        max_batch distinct contracts) into one batched computation, identical contracts in a
+        batch are priced once, and the heavy batches run on a pool of worker processes (or
+        the given executor) without blocking the event loop. max_batch=1 turns coalescing
+        off. Use as an async context manager, see LocalClient
+    '''
+    def __init__(self, workers=1, window=0.002, max_batch=1024, executor=None, latency_samples=10000):
+        super(PricingService, self).__init__()
+        self.workers = workers
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor
+        self.owns_executor = executor is None
+        # Open batches: key -> OrderedDict(contract -> list of (future, submit time)), and the
+        # timer that flushes each when its window has run
+        self.pending = {}
+        self.timers = {}
+        self.tasks = set()
+        self.latencies = deque(maxlen=latency_samples)
+        self.counts = defaultdict(int)
+        self.started = None
+
+    async def __aenter__(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.drain()
+        if self.owns_executor:
+            # All batches are done, so the workers are idle and the shutdown need not block the loop
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def drain(self):
+        ''' Flush the open batches and wait for all running ones '''
+        for key in list(self.pending):
+            self.flush(key)
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def price(self, pricer, initial_price, strike_price, interest_rate, volatility, time_to_maturity,
+                    option_type='call', **settings) -> dict:
+        '''
+            Price one contract, returning {'price', 'error'} with error as in the batch
+            function of the pricer (conf95, moment matching estimate, FDS Richardson correction
+            or 0). settings are the method keywords of the pricer (grid sizes, path counts,
+            tolerance, ...)
+        '''
+        if pricer not in PRICERS:
+            raise ValueError(f'Unknown pricer "{pricer}", expected one of {list(PRICERS)}')
+        if option_type not in ('call', 'put'):
+            raise ValueError(f'Unknown option type "{option_type}", expected one of (\'call\', \'put\')')
+        contract = (float(initial_price), float(strike_price), float(interest_rate), float(volatility),
+                    float(time_to_maturity), option_type == 'call')
+        shared = tuple(contract[CONTRACT_FIELDS.index(name)] for name in PRICERS[pricer][1])
+        key = (pricer, shared, tuple(sorted(settings.items())))
+
+        future = asyncio.get_running_loop().create_future()
+        self.counts['requests'] += 1
+        if key not in self.pending:
+            self.pending[key] = OrderedDict()
+            if self.max_batch > 1:
+                self.timers[key] = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+        batch = self.pending[key]
+        if contract in batch:
+            self.counts['coalesced'] += 1
+        batch.setdefault(contract, []).append((future, time.perf_counter()))
+        if len(batch) >= self.max_batch:
+            self.flush(key)
+        return await future
+
+    def flush(self, key):
+        ''' Start pricing the open batch of key, cancelling its window timer if flushed early '''
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.run_batch(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, key, batch):
+        pricer, _, settings = key
+        function, _, heavy = PRICERS[pricer]
+        contracts = list(batch)
+        self.counts['batches'] += 1
+        self.counts['batched contracts'] += len(contracts)
+        try:
+            if heavy:
+                prices, errors = await asyncio.get_running_loop().run_in_executor(self.executor, function, contracts,
+                                                                                  dict(settings))
+            else:
+                prices, errors = function(contracts, dict(settings))
+        except Exception as exception:
+            for waiters in batch.values():
+                for future, _ in waiters:
+                    if not future.done():
+                        future.set_exception(exception)
+            self.counts['failed'] += sum(len(waiters) for waiters in batch.values())
+            return
+        now = time.perf_counter()
+        for contract_waiters, price, error in zip(batch.values(), prices, errors):
+            for future, submitted in contract_waiters:
+                if not future.done():
+                    future.set_result({'price': float(price), 'error': float(error)})
+                self.latencies.append(now - submitted)
+                self.counts['completed'] += 1
+
+    def counters(self) -> dict:
+        '''
+            Request counts, the mean batch size, the latency percentiles (seconds, over the
+            latest latency_samples requests) and the throughput in completed requests per
+            second since the service started
+        '''
+        latencies = np.array(self.latencies)
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0
+        counters = dict(self.counts)
+        counters['mean batch size'] = self.counts['batched contracts'] / max(self.counts['batches'], 1)
+        if len(latencies):
+            counters.update({'latency p50': float(np.percentile(latencies, 50)),
+                             'latency p95': float(np.percentile(latencies, 95)),
+                             'latency max': float(latencies.max())})
+        counters['throughput'] = self.counts['completed'] / elapsed if elapsed > 0 else 0.0
+        return counters
+
+
+class LocalClient(object):
+    ''' In-process client of a PricingService, sending requests (dicts of PricingService.price arguments) concurrently '''
+    def __init__(self, service):
+        super(LocalClient, self).__init__()
+        self.service = service
+
+    async def quote(self, request: dict) -> dict:
+        return await self.service.price(**request)
+
+    async def quote_all(self, requests: list) -> list:
+        ''' Results in request order, exceptions returned in place of failed results '''
+        return await asyncio.gather(*(self.quote(request) for request in requests), return_exceptions=True)
+
+
+def serve(requests: list, **service_settings):
+    ''' Start a PricingService, quote the requests concurrently from a LocalClient and return the results and counters '''
+    async def session():
+        async with PricingService(**service_settings) as service:
+            results = await LocalClient(service).quote_all(requests)
+        return results, service.counters()
+    return asyncio.run(session())
+
+
+if __name__ == '__main__':
+    # A burst of quotes on a few underlyings, with many repeated contracts
+    rng = np.random.default_rng(0)
+    requests = [dict(pricer=rng.choice(['FDS', 'Asian', 'Black-Scholes']), initial_price=rng.choice([45, 50, 55]),
+                     strike_price=50, interest_rate=0.05, volatility=rng.choice([0.2, 0.3]), time_to_maturity=1,
+                     option_type=rng.choice(['call', 'put'])) for _ in range(500)]
+    results, counters = serve(requests)
+    for name, value in counters.items():
+        print(f'{name:>18}: {value:.4g}')
@@ -0,0 +1,77 @@
+import AsianOptions
+import numpy as np
+import hashlib
+import json
+import os
+
+
+class ResultStore(object):
+    '''
+        On-disk store of sweep results in directory. Every priced grid point is kept under the
+        hash of its pricer, parameters and method settings, as a JSON description next to a
+        .npy array of its result values, and every solved FDS grid u as a .npy file that is
+        memory-mapped on load, so large grids are paged in lazily instead of read into RAM
+    '''
+    def __init__(self, directory=os.path.join('Results', 'store')):
+        super(ResultStore, self).__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        ''' Hash of the parts as sorted JSON, with numpy scalars written as Python numbers '''
+        text = json.dumps(parts, sort_keys=True,
+                          default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def contains(self, key) -> bool:
+        return os.path.exists(self.path(key, 'json'))
+
+    def save_result(self, key, result: dict, wall_time, description=None):
+        '''
+            Store the scalar results of one grid point (prices, conf95, path counts, ...) with
+            the wall time of the job it was priced in. The description is written last, so an
+            interrupted write leaves no entry
+        '''
+        names = list(result)
+        values = np.lib.format.open_memmap(self.path(key, 'npy'), mode='w+', dtype=np.float64, shape=(len(names),))
+        values[:] = [result[name] for name in names]
+        values.flush()
+        del values
+        with open(self.path(key, 'json'), 'w') as file:
+            json.dump({'names': names, 'integers': [name for name in names if isinstance(result[name], int)],
+                       'wall time': wall_time, 'description': description},
+                      file, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+    def load_result(self, key):
+        ''' The result dict and wall time stored under key '''
+        with open(self.path(key, 'json')) as file:
+            meta = json.load(file)
+        values = np.load(self.path(key, 'npy'), mmap_mode='r')
+        result = {name: int(value) if name in meta['integers'] else float(value)
+                  for name, value in zip(meta['names'], values)}
+        return result, meta['wall time']
+
+    def grid(self, interest_rate, volatility, time_to_maturity, time_partition_size, spatial_partition_size,
+             spatial_size=3, method='banded', stats=None) -> AsianOptions.AsianOptionGrid:
+        '''
+            Solved AsianOptionGrid, with u memory-mapped read-only from the store if this grid
+            was solved before and otherwise solved straight into a new memory-mapped file
+        '''
+        grid = AsianOptions.AsianOptionGrid(interest_rate, volatility, time_to_maturity, time_partition_size,
+                                            spatial_partition_size, spatial_size)
+        path = self.path(self.key('FDS call grid', interest_rate, volatility, time_to_maturity, time_partition_size,
+                                  spatial_partition_size, spatial_size, method), 'npy')
+        if not os.path.exists(path):
+            # Solve into a temporary file and rename it, so concurrent or interrupted solves leave no partial grid
+            temporary = f'{path}.{os.getpid()}.tmp'
+            u = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float64,
+                                          shape=(time_partition_size+1, spatial_partition_size+1))
+            grid.solve(method, out=u, stats=stats)
+            u.flush()
+            del u
+            os.replace(temporary, path)
+        return grid.load(np.load(path, mmap_mode='r'))
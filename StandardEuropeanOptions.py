@@ -1,5 +1,156 @@
 import numpy as np
-from scipy.stats import norm
+
+# Layout of a structured array holding a whole option chain, one contract per record
+CHAIN_DTYPE = np.dtype([('initial_price', np.float64),
+                        ('strike_price', np.float64),
+                        ('interest_rate', np.float64),
+                        ('volatility', np.float64),
+                        ('time_to_maturity', np.float64),
+                        ('is_call', np.bool_)])
+
+
+def d1_d2(initial_price, strike_price, interest_rate, volatility, time_to_maturity):
+    ''' The d1 and d2 arguments of the Black-Scholes formula, element-wise over arrays '''
+    volatility_sqrt_time = volatility * np.sqrt(time_to_maturity)
+    d2 = (np.log(initial_price / strike_price) + (
+                interest_rate - 0.5 * volatility ** 2) * time_to_maturity) / volatility_sqrt_time
+    d1 = d2 + volatility_sqrt_time
+    return d1, d2
+
+
+def black_scholes_price(initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call=True):
+    '''
+        Price a whole option chain in one vectorized pass. All arguments are broadcast
+        against each other, so e.g. a column of strikes and a row of maturities give the
+        full strike x maturity surface. is_call selects call (True) or put (False) per contract
+    '''
+    from scipy.special import ndtr
+    initial_price = np.asarray(initial_price, dtype=np.float64)
+    strike_price = np.asarray(strike_price, dtype=np.float64)
+    d1, d2 = d1_d2(initial_price, strike_price, interest_rate, volatility, time_to_maturity)
+
+    # From formula in Black-Scholes market, with sign = +1 for calls and -1 for puts
+    sign = np.where(is_call, 1.0, -1.0)
+    discounted_strike = strike_price * np.exp(-interest_rate * time_to_maturity)
+    price = sign * (initial_price * ndtr(sign * d1) - discounted_strike * ndtr(sign * d2))
+    return price[()]
+
+
+def black_scholes_greeks(initial_price, strike_price, interest_rate, volatility, time_to_maturity, is_call=True):
+    '''
+        Price together with the first and second order Greeks from one evaluation, sharing
+        d1/d2, the normal cdf/pdf and the discount factor. Broadcasts like black_scholes_price
+        and returns a dict of arrays with keys price, delta, gamma, vega, theta, rho, vanna
+        and volga (theta per year, vega/rho per unit change in volatility/rate)
+    '''
+    from scipy.special import ndtr
+    initial_price = np.asarray(initial_price, dtype=np.float64)
+    strike_price = np.asarray(strike_price, dtype=np.float64)
+    sqrt_time = np.sqrt(time_to_maturity)
+    d1, d2 = d1_d2(initial_price, strike_price, interest_rate, volatility, time_to_maturity)
+
+    sign = np.where(is_call, 1.0, -1.0)
+    discounted_strike = strike_price * np.exp(-interest_rate * time_to_maturity)
+    cdf_d1 = ndtr(sign * d1)
+    cdf_d2 = ndtr(sign * d2)
+    pdf_d1 = np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi)
+    vega = initial_price * pdf_d1 * sqrt_time
+
+    greeks = {'price': sign * (initial_price * cdf_d1 - discounted_strike * cdf_d2),
+              'delta': sign * cdf_d1,
+              'gamma': pdf_d1 / (initial_price * volatility * sqrt_time),
+              'vega': vega,
+              'theta': -vega * volatility / (2 * time_to_maturity) - sign * interest_rate * discounted_strike * cdf_d2,
+              'rho': sign * time_to_maturity * discounted_strike * cdf_d2,
+              'vanna': -pdf_d1 * d2 / volatility,
+              'volga': vega * d1 * d2 / volatility}
+    return {name: np.asarray(value)[()] for name, value in greeks.items()}
+
+
+def implied_volatility_guess(price, initial_price, strike_price, interest_rate, time_to_maturity, is_call=True):
+    '''
+        Rational initial guess of Corrado and Miller for the implied volatility, on the call
+        price (puts through put-call parity), falling back to Brenner and Subrahmanyam where
+        the square root has no real value
+    '''
+    discounted_strike = strike_price * np.exp(-interest_rate * time_to_maturity)
+    call_price = np.where(is_call, price, price + initial_price - discounted_strike)
+    moneyness = initial_price - discounted_strike
+    half_distance = call_price - moneyness / 2
+    root = half_distance ** 2 - moneyness ** 2 / np.pi
+    scale = np.sqrt(2 * np.pi / time_to_maturity)
+    guess = np.where(root > 0,
+                     scale / (initial_price + discounted_strike) * (half_distance + np.sqrt(np.maximum(root, 0))),
+                     scale * call_price / initial_price)
+    return np.clip(guess, 0.01, 2.0)
+
+
+def implied_volatility(price, initial_price, strike_price, interest_rate, time_to_maturity, is_call=True,
+                       tolerance=1e-10, max_iterations=50):
+    '''
+        Black-Scholes implied volatilities of a whole set of quotes at once. All arguments are
+        broadcast against each other like in black_scholes_price. Starting from
+        implied_volatility_guess, Halley steps use vega and volga from the same
+        black_scholes_greeks pass (Newton where the Halley correction is unreliable, bisection
+        of a per-quote bracket where the step leaves it) and only the entries not yet converged
+        (price error within tolerance of the time value, or relative step within tolerance)
+        are iterated further. Returns the volatilities and per-element convergence flags; quotes outside the
+        no-arbitrage bounds give nan and False
+    '''
+    arguments = np.broadcast_arrays(price, initial_price, strike_price, interest_rate, time_to_maturity, is_call)
+    shape = arguments[0].shape
+    price, initial_price, strike_price, interest_rate, time_to_maturity = [
+        np.asarray(argument, dtype=np.float64).ravel() for argument in arguments[:5]]
+    is_call = np.asarray(arguments[5], dtype=np.bool_).ravel()
+
+    # No-arbitrage bounds, intrinsic value < price < S (call) or K e^{-rT} (put)
+    discounted_strike = strike_price * np.exp(-interest_rate * time_to_maturity)
+    lower = np.where(is_call, np.maximum(initial_price - discounted_strike, 0),
+                     np.maximum(discounted_strike - initial_price, 0))
+    upper = np.where(is_call, initial_price, discounted_strike)
+    valid = (price > lower) & (price < upper)
+
+    volatility = np.full(price.shape, np.nan)
+    converged = np.zeros(price.shape, dtype=np.bool_)
+    volatility[valid] = implied_volatility_guess(price[valid], initial_price[valid], strike_price[valid],
+                                                 interest_rate[valid], time_to_maturity[valid], is_call[valid])
+    # Bracket of the root, the price being increasing in the volatility
+    lower_volatility = np.full(price.shape, 1e-8)
+    upper_volatility = np.full(price.shape, 10.0)
+    active = np.flatnonzero(valid)
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+        sigma = volatility[active]
+        greeks = black_scholes_greeks(initial_price[active], strike_price[active], interest_rate[active],
+                                      sigma, time_to_maturity[active], is_call[active])
+        error = greeks['price'] - price[active]
+        lower_volatility[active] = np.where(error < 0, sigma, lower_volatility[active])
+        upper_volatility[active] = np.where(error > 0, sigma, upper_volatility[active])
+
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            newton = error / greeks['vega']
+            correction = 1 - 0.5 * newton * greeks['volga'] / greeks['vega']
+            step = np.where(np.abs(correction - 1) < 0.5, newton / correction, newton)
+        # Bisect where the step leaves the bracket (vanishing vega far from the money)
+        candidate = sigma - step
+        outside = ~((candidate > lower_volatility[active]) & (candidate < upper_volatility[active]))
+        candidate[outside] = 0.5 * (lower_volatility[active] + upper_volatility[active])[outside]
+
+        # Converged when the price error is small against the time value, or the step against the volatility
+        priced = np.abs(error) <= tolerance * (price[active] - lower[active])
+        volatility[active] = np.where(priced, sigma, candidate)
+        done = priced | (np.abs(candidate - sigma) <= tolerance * sigma)
+        converged[active[done]] = True
+        active = active[~done]
+    return volatility.reshape(shape)[()], converged.reshape(shape)[()]
+
+
+def price_chain(chain):
+    ''' Black-Scholes prices for a structured array with the fields of CHAIN_DTYPE '''
+    return black_scholes_price(chain['initial_price'], chain['strike_price'], chain['interest_rate'],
+                               chain['volatility'], chain['time_to_maturity'], chain['is_call'])
+
 
 class StandardCallOption(object):
     def __init__(self,
@@ -16,16 +167,12 @@ class StandardCallOption(object):
         self.time_to_maturity = time_to_maturity
 
     def compute(self):
-        d2 = (np.log(self.initial_price / self.strike_price) + (
-                    self.interest_rate - 0.5 * self.volatility ** 2) * self.time_to_maturity) / (
-                         self.volatility / np.sqrt(self.time_to_maturity))
-        d1 = d2 + self.volatility * np.sqrt(self.time_to_maturity)
+        return black_scholes_price(self.initial_price, self.strike_price, self.interest_rate,
+                                   self.volatility, self.time_to_maturity, is_call=True)
 
-        # From formula in Black-Scholes market
-        price = self.initial_price * norm.cdf(d1) - \
-                self.strike_price * np.exp(-self.interest_rate * self.time_to_maturity) * norm.cdf(d2)
-
-        return price
+    def greeks(self):
+        return black_scholes_greeks(self.initial_price, self.strike_price, self.interest_rate,
+                                    self.volatility, self.time_to_maturity, is_call=True)
 
 class StandardPutOption(object):
     def __init__(self,
@@ -42,13 +189,9 @@ class StandardPutOption(object):
         self.time_to_maturity = time_to_maturity
 
     def compute(self):
-        d2 = (np.log(self.initial_price / self.strike_price) + (
-                    self.interest_rate - 0.5 * self.volatility ** 2) * self.time_to_maturity) / (
-                         self.volatility / np.sqrt(self.time_to_maturity))
-        d1 = d2 + self.volatility * np.sqrt(self.time_to_maturity)
-
-        # From formula in Black-Scholes market
-        price = self.strike_price * np.exp(-self.interest_rate * self.time_to_maturity) * norm.cdf(-d2) - \
-                self.initial_price * norm.cdf(-d1)
+        return black_scholes_price(self.initial_price, self.strike_price, self.interest_rate,
+                                   self.volatility, self.time_to_maturity, is_call=False)
 
-        return price
+    def greeks(self):
+        return black_scholes_greeks(self.initial_price, self.strike_price, self.interest_rate,
+                                    self.volatility, self.time_to_maturity, is_call=False)